@@ -1,52 +1,143 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import Response, StreamingResponse
 from backend.auth import get_api_key
 from backend.models.schemas import ChatRequest, ChatResponse
-from backend.services.hf_model_service import HFModelService
+from backend.services.hf_model_service import get_hf_service
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+import asyncio
+import os
+import threading
 import time
 import logging
+import orjson
 
 # Initialize logging
 logger = logging.getLogger(__name__)
 
 # Service singleton
-hf_model_service = HFModelService()
+hf_model_service = get_hf_service()
+
+# Dedicated executor for blocking model generation.
+# A single worker keeps generations from contending for the model/device
+# while the event loop stays free to accept and serialize other requests.
+generation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generation")
+
+# Micro-batching: concurrent /chat requests are queued and generated together
+MAX_BATCH = int(os.getenv("MAX_BATCH", "4"))
+MAX_WAIT_MS = int(os.getenv("MAX_WAIT_MS", "20"))
+pending: "asyncio.Queue[Tuple[str, dict, asyncio.Future]]" = asyncio.Queue()
+
+async def batch_worker():
+    """Collect queued chat requests into batches and run them through the model"""
+    loop = asyncio.get_running_loop()
+    while True:
+        # Block until the first request arrives, then fill the batch within the wait window
+        batch = [await pending.get()]
+        deadline = loop.time() + MAX_WAIT_MS / 1000
+        while len(batch) < MAX_BATCH:
+            # Take whatever is already queued without waiting; under load the batch fills immediately
+            try:
+                batch.append(pending.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(pending.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        # Requests can only share a generate() call when their parameters match
+        groups = {}
+        for item in batch:
+            groups.setdefault(orjson.dumps(item[1], option=orjson.OPT_SORT_KEYS), []).append(item)
+
+        for group in groups.values():
+            messages = [message for message, _, _ in group]
+            try:
+                results = await loop.run_in_executor(
+                    generation_executor, hf_model_service.generate_batch, messages, group[0][1]
+                )
+            except Exception as e:
+                logger.error(f"Batched generation failed for {len(group)} requests: {str(e)}")
+                for _, _, fut in group:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            for (_, _, fut), text in zip(group, results):
+                if not fut.done():
+                    fut.set_result(text)
+
+def _request_params(request: ChatRequest) -> dict:
+    """Generation parameters the client explicitly set on the request"""
+    overrides = request.parameters
+    if overrides is None:
+        return {}
+    # Only read the fields the client sent instead of dumping every default
+    return {k: v for k in overrides.model_fields_set if (v := getattr(overrides, k)) is not None}
+
+def _utcnow_iso() -> str:
+    """Current UTC time as an ISO-8601 string (YYYY-MM-DDTHH:MM:SSZ)"""
+    t = time.gmtime()
+    return f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}T{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}Z"
 
 router = APIRouter()
 
+# Background model pre-load task, registered by the app at startup; generation waits for it to finish
+model_load_task: Optional[asyncio.Task] = None
+
+async def require_model():
+    """Dependency: 503 until the model has finished loading (async, so it never waits for a threadpool slot)"""
+    if (model_load_task is not None and not model_load_task.done()) or not hf_model_service.is_model_loaded():
+        raise HTTPException(
+            status_code=503,
+            detail="Model not loaded. The system is still initializing or the model failed to load."
+        )
+
+# Static liveness payload, serialized once
+_HEALTH_RESPONSE = Response(content=b'{"status":"ok"}', media_type="application/json")
+
 @router.get("/health")
-def health():
-    return {"status": "ok"}
+async def health():
+    return _HEALTH_RESPONSE
+
+# Serialized /models payload, tagged with the service state version it was built from
+_models_cache: Optional[Tuple[int, bytes]] = None
 
 @router.get("/models", dependencies=[Depends(get_api_key)])
-def list_models():
+async def list_models():
     """List available models"""
+    global _models_cache
     try:
-        logger.info("=== MODELS LIST REQUEST ===")
-        
-        # Check if model is loaded
-        model_loaded = hf_model_service.is_model_loaded()
+        version = hf_model_service.state_version
+        if _models_cache is None or _models_cache[0] != version:
+            # Check if model is loaded
+            model_loaded = hf_model_service.is_model_loaded()
+            
+            models = [
+                {
+                    "id": "code-du-travail-mistral",
+                    "name": "Code du Travail Mistral",
+                    "status": "loaded" if model_loaded else "available",
+                    "description": "French labor law assistant model",
+                    "parameters": hf_model_service.get_parameters() if model_loaded else {}
+                }
+            ]
+            _models_cache = (version, orjson.dumps({"models": models}))
+            logger.info(f"Rebuilt models list ({len(models)} models)")
         
-        models = [
-            {
-                "id": "code-du-travail-mistral",
-                "name": "Code du Travail Mistral",
-                "status": "loaded" if model_loaded else "available",
-                "description": "French labor law assistant model",
-                "parameters": hf_model_service.get_parameters() if model_loaded else {}
-            }
-        ]
-        
-        logger.info(f"Returning {len(models)} models")
-        logger.info("=== MODELS LIST REQUEST END ===")
-        
-        return {"models": models}
+        return Response(content=_models_cache[1], media_type="application/json")
         
     except Exception as e:
         logger.error(f"Error in models endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/test")
-def test_request(request: dict):
+async def test_request(request: dict):
     """Test endpoint to see what JSON is being received"""
     logger.info(f"=== TEST REQUEST ===")
     logger.info(f"Received JSON: {request}")
@@ -54,50 +145,70 @@ def test_request(request: dict):
     return {"received": request}
 
 # --- Chat Endpoint ---
-@router.post("/chat", response_model=ChatResponse, dependencies=[Depends(get_api_key)])
-def chat(request: ChatRequest):
+@router.post("/chat", response_model=ChatResponse, dependencies=[Depends(get_api_key), Depends(require_model)])
+async def chat(request: ChatRequest):
     try:
-        logger.info(f"=== CHAT REQUEST START ===")
-        logger.info(f"Received chat request: message='{request.message[:50]}...', channel='{request.channel}', user_id='{request.user_id}'")
-        
-        # Check if model is loaded
-        logger.info(f"Checking if model is loaded...")
-        model_loaded = hf_model_service.is_model_loaded()
-        logger.info(f"Model loaded status: {model_loaded}")
-        
-        if not model_loaded:
-            logger.error("Model not loaded - raising 503 error")
-            raise HTTPException(
-                status_code=503, 
-                detail="Model not loaded. The system is still initializing or the model failed to load."
-            )
-        
-        logger.info("Model is loaded, proceeding with request...")
-        
-        # Use HFModelService for inference with its own parameters
-        logger.info(f"Calling HF model service with message: '{request.message[:50]}...'")
-        response_text = hf_model_service.generate_response(request.message)
+        logger.info("Chat request for user %s on channel %s", request.user_id, request.channel)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Chat message: '%s...'", request.message[:50])
+
+        # Merge the client overrides that were set onto the service defaults in a single expression
+        params = hf_model_service.parameters | _request_params(request)
+        # Deterministic repeats are answered from the service cache without queueing
+        response_text = hf_model_service.get_cached_response(request.message, params)
+
+        if response_text is not None:
+            logger.debug("Serving response from cache")
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            await pending.put((request.message, params, fut))
+            response_text = await fut
+            hf_model_service.cache_response(request.message, params, response_text)
         
-        logger.info(f"Got response from model, length: {len(response_text)}")
-        logger.info(f"Response preview: '{response_text[:100]}...'")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Response length: %d, preview: '%s...'", len(response_text), response_text[:100])
         
-        resp = ChatResponse(
+        # Server-generated values: skip field validation on construction
+        resp = ChatResponse.model_construct(
             response=response_text,
             model="Pyzeur/Code-du-Travail-mistral-finetune",
-            timestamp=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-            parameters_used=hf_model_service.get_parameters()
+            timestamp=_utcnow_iso(),
+            parameters_used=params
         )
-        
-        logger.info(f"Chat request processed successfully for user {request.user_id} on channel {request.channel}")
-        logger.info(f"=== CHAT REQUEST END ===")
         return resp
         
     except HTTPException as he:
-        logger.error(f"HTTP Exception in chat endpoint: {he.status_code} - {he.detail}")
+        logger.error("HTTP Exception in chat endpoint: %s - %s", he.status_code, he.detail)
         raise
     except Exception as e:
-        logger.error(f"Unexpected error in chat endpoint: {str(e)}")
-        logger.error(f"Error type: {type(e)}")
-        import traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        logger.exception("Unexpected error in chat endpoint: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/chat/stream", dependencies=[Depends(get_api_key), Depends(require_model)])
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """Stream the generated response as Server-Sent Events while tokens are produced"""
+    params = _request_params(request)
+    stop = threading.Event()
+    # Queued on the generation executor, so streamed and batched generations take turns on the model
+    streamer = hf_model_service.generate_stream(
+        request.message, params, executor=generation_executor, stop_event=stop
+    )
+
+    # Async generator: waiting for tokens doesn't hold a threadpool thread for the whole generation
+    async def event_gen():
+        try:
+            async for text in streamer:
+                if await http_request.is_disconnected():
+                    return
+                yield b"data: " + orjson.dumps({"text": text}) + b"\n\n"
+            yield b"data: [DONE]\n\n"
+        finally:
+            # Client gone (or stream done): stop generating so the executor moves on to the next request
+            stop.set()
+
+    # Tell nginx not to buffer the stream so each chunk reaches the client as soon as it is generated
+    return StreamingResponse(
+        event_gen(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
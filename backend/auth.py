@@ -1,15 +1,24 @@
+import hmac
 from fastapi import Header, HTTPException, status, Depends
 from backend.config import settings
 
+# Accepted tokens, encoded once for constant-time comparison
+_API_KEY = settings.API_KEY.encode()
+_ADMIN_TOKEN = settings.ADMIN_TOKEN.encode()
+_ALLOWED = (_API_KEY, _ADMIN_TOKEN)
+
 def get_api_key(authorization: str = Header(...)):
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authorization header format")
-    token = authorization.split(" ", 1)[1]
-    if token != settings.API_KEY and token != settings.ADMIN_TOKEN:
+    token = authorization[7:]
+    token_bytes = token.encode()
+    # Check every candidate so timing doesn't reveal which one matched
+    matches = [hmac.compare_digest(token_bytes, allowed) for allowed in _ALLOWED]
+    if not any(matches):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API key or token")
     return token
 
 def require_admin_token(token: str = Depends(get_api_key)):
-    if token != settings.ADMIN_TOKEN:
+    if not hmac.compare_digest(token.encode(), _ADMIN_TOKEN):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
-    return token 
\ No newline at end of file
+    return token
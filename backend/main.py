@@ -1,43 +1,55 @@
 from fastapi import FastAPI
-from fastapi.responses import JSONResponse
-from fastapi.middleware.cors import CORSMiddleware
-from backend.api.routes import router as api_router, hf_model_service
+from fastapi.responses import ORJSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from backend.middleware.cors import CORSMiddleware
+from backend.api import routes as api_routes
+from backend.api.routes import router as api_router, hf_model_service, batch_worker
 import os
 import logging
 import asyncio
 
-# Logging setup
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger("aidalneo")
-
 # Detect environment and allowed origins
-ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
+ALLOWED_ORIGINS = frozenset(o.strip() for o in os.getenv("ALLOWED_ORIGINS", "*").split(",") if o.strip())
+# Auth uses the Authorization header, not cookies; a wildcard policy can then send a static "*" origin
+ALLOW_CREDENTIALS = "*" not in ALLOWED_ORIGINS
 ENV = os.getenv("ENV", "development")
 
+# Logging setup (keep production logs to warnings and errors)
+logging.basicConfig(level=logging.WARNING if ENV == "production" else logging.INFO)
+logger = logging.getLogger("aidalneo")
+
 logger.info(f"Starting Aid-al-Neo API in {ENV} mode.")
 logger.info(f"Allowed CORS origins: {ALLOWED_ORIGINS}")
 
 app = FastAPI(
     title="Aid-al-Neo API",
     version="1.0.0",
-    description="Production-ready AI model API platform."
+    description="Production-ready AI model API platform.",
+    default_response_class=ORJSONResponse
 )
 
 # CORS (allow all origins for now, restrict in production)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
-    allow_credentials=True,
+    allow_credentials=ALLOW_CREDENTIALS,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# Compress larger JSON bodies (long French answers shrink several-fold); Starlette leaves SSE streams uncompressed
+if os.getenv("ENABLE_GZIP", "1") == "1":
+    app.add_middleware(GZipMiddleware, minimum_size=500, compresslevel=5)
+
 app.include_router(api_router, prefix="/api/v1")
 
-@app.on_event("startup")
-async def startup_event():
-    """Pre-load the model when the application starts"""
-    logger.info("Starting model pre-loading...")
+# Background task draining the chat batching queue (kept referenced so it isn't GC'd)
+batch_worker_task = None
+# Background model pre-load task (kept referenced so it isn't GC'd)
+LOAD_TASK = None
+
+def _preload_model():
+    """Load the model (blocking); runs in a worker thread so the API can serve /health meanwhile"""
     try:
         # Use the same HF model service instance that will be used by routes
         # Load the Pyzeur/Code-du-Travail-mistral-finetune model
@@ -46,10 +58,23 @@ async def startup_event():
         finetuned_model = "Pyzeur/Code-du-Travail-mistral-finetune"
         
         logger.info(f"Loading model: {finetuned_model}")
-        hf_model_service.load_model(base_model, finetuned_model)
+        # Optional graph compilation (slow first start, faster inference afterwards). It happens inside
+        # load_model, before the model is published, so requests never run on a half-initialized model.
+        hf_model_service.load_model(base_model, finetuned_model, compile=os.getenv("TORCH_COMPILE", "0") == "1")
+
         logger.info("Model loaded successfully and ready for inference!")
         
     except Exception as e:
         logger.error(f"Failed to load model: {str(e)}")
-        # Don't raise the exception to allow the app to start
-        # The chat endpoint will handle the case when model is not loaded 
\ No newline at end of file
+        # Don't raise the exception to keep the app running
+        # The chat endpoint will handle the case when model is not loaded
+
+@app.on_event("startup")
+async def startup_event():
+    """Pre-load the model in the background when the application starts"""
+    global batch_worker_task, LOAD_TASK
+    batch_worker_task = asyncio.create_task(batch_worker())
+    logger.info("Starting model pre-loading...")
+    LOAD_TASK = asyncio.create_task(asyncio.to_thread(_preload_model))
+    # Chat and streaming return 503 until it completes
+    api_routes.model_load_task = LOAD_TASK
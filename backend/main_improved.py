@@ -1,143 +1,139 @@
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
-from fastapi.middleware.cors import CORSMiddleware
-from backend.api.routes import router as api_router, hf_model_service
-from backend.middleware.rate_limiter import rate_limit_middleware
-from backend.middleware.timeout import timeout_middleware
+from fastapi.responses import ORJSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from backend.middleware.cors import CORSMiddleware
+from backend.api import routes as api_routes
+from backend.api.routes import router as api_router, hf_model_service, batch_worker
+from backend.middleware.rate_limiter import RateLimitMiddleware, rate_limiter
+from backend.middleware.timeout import TimeoutMiddleware
+from backend.middleware.request_tracking import RequestTrackingMiddleware, RequestIdFilter, request_id_var
 from backend.utils.monitoring import api_monitor
+from backend.utils.logging_utils import setup_queue_logging, flush_periodically
 import os
 import logging
 import time
+from datetime import datetime, timezone
 import asyncio
-import uuid
-
-# Enhanced logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('./logs/api.log'),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger("aidalneo")
 
 # Detect environment and allowed origins
-ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
+ALLOWED_ORIGINS = frozenset(o.strip() for o in os.getenv("ALLOWED_ORIGINS", "*").split(",") if o.strip())
+# Auth uses the Authorization header, not cookies; a wildcard policy can then send a static "*" origin
+ALLOW_CREDENTIALS = "*" not in ALLOWED_ORIGINS
 ENV = os.getenv("ENV", "development")
 
+# Enhanced logging setup (keep production logs to warnings and errors)
+# Records are queued on the request path and written by a listener thread to a buffered file
+log_listener, log_file_handler = setup_queue_logging(
+    level=logging.WARNING if ENV == "production" else logging.INFO,
+    fmt='%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] - %(message)s',
+    log_file='./logs/api.log',
+    filters=[RequestIdFilter()],
+)
+logger = logging.getLogger("aidalneo")
+
 logger.info(f"Starting Aid-al-Neo API in {ENV} mode.")
 logger.info(f"Allowed CORS origins: {ALLOWED_ORIGINS}")
 
 app = FastAPI(
     title="Aid-al-Neo API",
     version="1.0.0",
-    description="Production-ready AI model API platform with enhanced security and monitoring."
+    description="Production-ready AI model API platform with enhanced security and monitoring.",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
-    allow_credentials=True,
+    allow_credentials=ALLOW_CREDENTIALS,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-# Custom middleware for request tracking
-@app.middleware("http")
-async def add_request_id(request: Request, call_next):
-    """Add unique request ID for tracking"""
-    request_id = str(uuid.uuid4())
-    request.state.request_id = request_id
-    
-    # Add request ID to response headers
-    response = await call_next(request)
-    response.headers["X-Request-ID"] = request_id
-    return response
-
-@app.middleware("http")
-async def monitor_requests(request: Request, call_next):
-    """Monitor request performance and health"""
-    start_time = time.time()
-    success = True
-    
-    try:
-        response = await call_next(request)
-        return response
-    except Exception as e:
-        success = False
-        logger.error(f"Request failed: {str(e)}")
-        raise
-    finally:
-        duration = time.time() - start_time
-        api_monitor.record_request(duration, success)
-        
-        # Log request details
-        logger.info(
-            f"Request {request.state.request_id}: "
-            f"{request.method} {request.url.path} - "
-            f"{duration:.3f}s - {'SUCCESS' if success else 'FAILED'}"
-        )
+# Compress larger JSON bodies (long French answers shrink several-fold); Starlette leaves SSE streams uncompressed
+if os.getenv("ENABLE_GZIP", "1") == "1":
+    app.add_middleware(GZipMiddleware, minimum_size=500, compresslevel=5)
 
-# Rate limiting middleware
-@app.middleware("http")
-async def rate_limit(request: Request, call_next):
-    """Apply rate limiting"""
-    return await rate_limit_middleware(request, call_next)
+# Request tracking, rate limiting and timeouts as pure ASGI middleware
+# (the last one added is the outermost)
+app.add_middleware(TimeoutMiddleware, timeout_seconds=60)
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(RequestTrackingMiddleware, monitor=api_monitor)
 
-# Timeout middleware
-@app.middleware("http")
-async def timeout_handler(request: Request, call_next):
-    """Apply request timeout"""
-    return await timeout_middleware(request, call_next)
+# ISO-8601 timestamp for error and health bodies, formatted at most once per second
+_last_ts_second = None
+_last_ts = ""
+
+def _utc_timestamp() -> str:
+    global _last_ts_second, _last_ts
+    now = int(time.time())
+    if now != _last_ts_second:
+        _last_ts = datetime.fromtimestamp(now, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        _last_ts_second = now
+    return _last_ts
 
 # Global exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """Global exception handler with structured error responses"""
-    request_id = getattr(request.state, 'request_id', 'unknown')
+    request_id = request_id_var.get()
     
     logger.error(f"Global exception for request {request_id}: {str(exc)}")
     
     if isinstance(exc, HTTPException):
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=exc.status_code,
             content={
                 "error": {
                     "code": f"HTTP_{exc.status_code}",
                     "message": exc.detail,
                     "request_id": request_id,
-                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+                    "timestamp": _utc_timestamp()
                 }
             }
         )
     
     # Handle unexpected errors
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "error": {
                 "code": "INTERNAL_SERVER_ERROR",
                 "message": "An unexpected error occurred",
                 "request_id": request_id,
-                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+                "timestamp": _utc_timestamp()
             }
         }
     )
 
 app.include_router(api_router, prefix="/api/v1")
 
+# Background tasks (kept referenced so they aren't GC'd)
+batch_worker_task = None
+rate_limit_sweeper_task = None
+log_flush_task = None
+LOAD_TASK = None
+
 # Enhanced health check endpoint
 @app.get("/health")
 async def health_check():
     """Enhanced health check with system metrics"""
+    # Not ready while the model is still being pre-loaded
+    if LOAD_TASK is not None and not LOAD_TASK.done():
+        return ORJSONResponse(
+            status_code=503,
+            content={
+                "status": "loading",
+                "timestamp": _utc_timestamp()
+            }
+        )
+
     try:
         # Check model status
         model_loaded = hf_model_service.is_model_loaded()
         
-        # Get system health
-        system_health = api_monitor.get_system_health()
+        # Get system health (samples CPU usage, so keep it off the event loop)
+        system_health = await asyncio.to_thread(api_monitor.get_system_health)
         
         # Get API stats
         api_stats = api_monitor.get_stats()
@@ -151,7 +147,7 @@ async def health_check():
         
         return {
             "status": overall_status,
-            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "timestamp": _utc_timestamp(),
             "model": {
                 "loaded": model_loaded,
                 "name": "Pyzeur/Code-du-Travail-mistral-finetune" if model_loaded else None
@@ -162,26 +158,27 @@ async def health_check():
         
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=503,
             content={
                 "status": "unhealthy",
                 "error": str(e),
-                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+                "timestamp": _utc_timestamp()
             }
         )
 
-@app.on_event("startup")
-async def startup_event():
-    """Enhanced startup with better error handling and monitoring"""
-    logger.info("Starting model pre-loading...")
+def _preload_model():
+    """Load the model (blocking); runs in a worker thread so the API keeps serving meanwhile"""
     try:
         # Use the same HF model service instance that will be used by routes
         base_model = "mistralai/Mistral-7B-Instruct-v0.3"
         finetuned_model = "Pyzeur/Code-du-Travail-mistral-finetune"
         
         logger.info(f"Loading model: {finetuned_model}")
-        hf_model_service.load_model(base_model, finetuned_model)
+        # Optional graph compilation (slow first start, faster inference afterwards). It happens inside
+        # load_model, before the model is published, so requests never run on a half-initialized model.
+        hf_model_service.load_model(base_model, finetuned_model, compile=os.getenv("TORCH_COMPILE", "0") == "1")
+
         logger.info("Model loaded successfully and ready for inference!")
         
         # Log system health after startup
@@ -190,9 +187,21 @@ async def startup_event():
         
     except Exception as e:
         logger.error(f"Failed to load model: {str(e)}")
-        # Don't raise the exception to allow the app to start
+        # Don't raise the exception to keep the app running
         # The chat endpoint will handle the case when model is not loaded
 
+@app.on_event("startup")
+async def startup_event():
+    """Enhanced startup: background workers plus non-blocking model pre-loading"""
+    global batch_worker_task, rate_limit_sweeper_task, log_flush_task, LOAD_TASK
+    batch_worker_task = asyncio.create_task(batch_worker())
+    rate_limit_sweeper_task = asyncio.create_task(rate_limiter.run_sweeper())
+    log_flush_task = asyncio.create_task(flush_periodically(log_file_handler))
+    logger.info("Starting model pre-loading...")
+    LOAD_TASK = asyncio.create_task(asyncio.to_thread(_preload_model))
+    # Chat and streaming return 503 until it completes
+    api_routes.model_load_task = LOAD_TASK
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
@@ -202,4 +211,8 @@ async def shutdown_event():
         hf_model_service.unload_model()
         logger.info("Model unloaded successfully")
     except Exception as e:
-        logger.error(f"Error during shutdown: {str(e)}") 
\ No newline at end of file
+        logger.error(f"Error during shutdown: {str(e)}")
+    finally:
+        # Drain queued log records and flush the buffered log file
+        log_listener.stop()
+        log_file_handler.flush()
@@ -0,0 +1,53 @@
+from starlette.datastructures import Headers
+from starlette.middleware.cors import CORSMiddleware as StarletteCORSMiddleware
+
+_PREFLIGHT_BODY = b"OK"
+
+class CORSMiddleware(StarletteCORSMiddleware):
+    """Starlette's CORS middleware with successful preflights answered from pre-encoded headers"""
+
+    def __init__(self, app, **kwargs):
+        super().__init__(app, **kwargs)
+        # Origins, methods and headers are fixed at startup, so the static part of the preflight is encoded once
+        self._preflight_raw_headers = [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in self.preflight_headers.items()
+        ] + [
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", str(len(_PREFLIGHT_BODY)).encode("latin-1")),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "OPTIONS":
+            headers = Headers(scope=scope)
+            if "origin" in headers and "access-control-request-method" in headers:
+                if await self._send_static_preflight(headers, send):
+                    return
+                # Disallowed preflight: let Starlette build the informative 400
+                response = self.preflight_response(request_headers=headers)
+                await response(scope, receive, send)
+                return
+        await super().__call__(scope, receive, send)
+
+    async def _send_static_preflight(self, request_headers: Headers, send) -> bool:
+        """Send a successful preflight response; return False if the request is not allowed"""
+        origin = request_headers["origin"]
+        requested_headers = request_headers.get("access-control-request-headers")
+
+        if not self.is_allowed_origin(origin=origin):
+            return False
+        if request_headers["access-control-request-method"] not in self.allow_methods:
+            return False
+        if requested_headers is not None and not self.allow_all_headers:
+            if any(h.strip() not in self.allow_headers for h in requested_headers.lower().split(",")):
+                return False
+
+        raw_headers = list(self._preflight_raw_headers)
+        if self.preflight_explicit_allow_origin:
+            raw_headers.append((b"access-control-allow-origin", origin.encode("latin-1")))
+        if self.allow_all_headers and requested_headers is not None:
+            raw_headers.append((b"access-control-allow-headers", requested_headers.encode("latin-1")))
+
+        await send({"type": "http.response.start", "status": 200, "headers": raw_headers})
+        await send({"type": "http.response.body", "body": _PREFLIGHT_BODY})
+        return True
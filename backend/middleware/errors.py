@@ -0,0 +1,19 @@
+import time
+from starlette.responses import JSONResponse
+from backend.middleware.request_tracking import request_id_var
+
+async def send_error(scope, receive, send, status_code: int, message: str):
+    """Send a structured error response (same shape as the global exception handler) from ASGI middleware"""
+    request_id = request_id_var.get()
+    response = JSONResponse(
+        status_code=status_code,
+        content={
+            "error": {
+                "code": f"HTTP_{status_code}",
+                "message": message,
+                "request_id": request_id,
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            }
+        }
+    )
+    await response(scope, receive, send)
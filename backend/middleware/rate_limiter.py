@@ -1,62 +1,94 @@
 import time
 import asyncio
-from collections import defaultdict, deque
-from fastapi import HTTPException, Request
 import logging
+from backend.middleware.errors import send_error
 
 logger = logging.getLogger(__name__)
 
+def _roll_window(window: int, count: int, previous: int, current_window: int):
+    """Advance a (window, count, previous_count) bucket to the current window"""
+    if current_window == window:
+        return window, count, previous
+    if current_window == window + 1:
+        return current_window, 0, count
+    return current_window, 0, 0
+
 class RateLimiter:
+    """
+    Sliding-window counter rate limiter.
+    Each client keeps a request count for the current and previous minute/hour bucket; the
+    previous bucket is weighted by how much of it still overlaps the sliding window. This is
+    O(1) per request, unlike keeping (and trimming) a timestamp per request.
+    """
     def __init__(self, requests_per_minute=60, requests_per_hour=1000):
         self.requests_per_minute = requests_per_minute
         self.requests_per_hour = requests_per_hour
-        self.minute_requests = defaultdict(deque)
-        self.hour_requests = defaultdict(deque)
-        
-    def _cleanup_old_requests(self, requests_dict, window_seconds):
-        """Remove requests older than the window"""
-        current_time = time.time()
-        for key in list(requests_dict.keys()):
-            while requests_dict[key] and current_time - requests_dict[key][0] > window_seconds:
-                requests_dict[key].popleft()
+        # client_id -> [minute, minute_count, prev_minute_count, hour, hour_count, prev_hour_count]
+        self.counts = {}
     
     def is_allowed(self, client_id: str) -> bool:
         """Check if request is allowed based on rate limits"""
-        current_time = time.time()
-        
-        # Cleanup old requests
-        self._cleanup_old_requests(self.minute_requests, 60)
-        self._cleanup_old_requests(self.hour_requests, 3600)
+        now = time.monotonic()
+        minute, minute_count, prev_minute_count, hour, hour_count, prev_hour_count = self.counts.get(
+            client_id, (0, 0, 0, 0, 0, 0)
+        )
+        minute, minute_count, prev_minute_count = _roll_window(minute, minute_count, prev_minute_count, int(now // 60))
+        hour, hour_count, prev_hour_count = _roll_window(hour, hour_count, prev_hour_count, int(now // 3600))
         
         # Check minute limit
-        if len(self.minute_requests[client_id]) >= self.requests_per_minute:
-            logger.warning(f"Rate limit exceeded for {client_id} (minute)")
+        minute_estimate = prev_minute_count * (1 - (now % 60) / 60) + minute_count
+        if minute_estimate >= self.requests_per_minute:
+            logger.warning("Rate limit exceeded for %s (minute)", client_id)
             return False
             
         # Check hour limit
-        if len(self.hour_requests[client_id]) >= self.requests_per_hour:
-            logger.warning(f"Rate limit exceeded for {client_id} (hour)")
+        hour_estimate = prev_hour_count * (1 - (now % 3600) / 3600) + hour_count
+        if hour_estimate >= self.requests_per_hour:
+            logger.warning("Rate limit exceeded for %s (hour)", client_id)
             return False
         
         # Add current request
-        self.minute_requests[client_id].append(current_time)
-        self.hour_requests[client_id].append(current_time)
+        self.counts[client_id] = [minute, minute_count + 1, prev_minute_count, hour, hour_count + 1, prev_hour_count]
         
         return True
 
+    def sweep(self):
+        """Forget clients that have not made a request in the current or previous hour"""
+        current_hour = int(time.monotonic() // 3600)
+        for client_id in [c for c, counts in self.counts.items() if counts[3] < current_hour - 1]:
+            self.counts.pop(client_id, None)
+
+    async def run_sweeper(self, interval_seconds=60):
+        """Periodically drop stale clients (run as a background task)"""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            self.sweep()
+
 # Global rate limiter instance
 rate_limiter = RateLimiter()
 
-async def rate_limit_middleware(request: Request, call_next):
+class RateLimitMiddleware:
     """Rate limiting middleware"""
-    # Extract client ID (IP address or API key)
-    client_id = request.headers.get("Authorization", request.client.host)
-    
-    if not rate_limiter.is_allowed(client_id):
-        raise HTTPException(
-            status_code=429,
-            detail="Rate limit exceeded. Please try again later."
-        )
-    
-    response = await call_next(request)
-    return response 
\ No newline at end of file
+
+    def __init__(self, app, limiter: RateLimiter = rate_limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        # Extract client ID (API key or IP address) straight from the scope
+        client_id = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                client_id = value.decode("latin-1")
+                break
+        if client_id is None:
+            client = scope.get("client")
+            client_id = client[0] if client else "unknown"
+
+        if not self.limiter.is_allowed(client_id):
+            return await send_error(scope, receive, send, 429, "Rate limit exceeded. Please try again later.")
+
+        await self.app(scope, receive, send)
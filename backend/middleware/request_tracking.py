@@ -0,0 +1,69 @@
+import time
+import secrets
+import logging
+from itertools import count
+from contextvars import ContextVar
+
+logger = logging.getLogger("aidalneo")
+
+# ID of the request being handled in the current context ("-" outside of requests)
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+# Request IDs are a random per-process prefix plus a counter: unique across workers and restarts
+# without drawing fresh randomness for every request
+_REQUEST_ID_PREFIX = secrets.token_hex(4)
+_request_counter = count(1)
+
+def _next_request_id() -> str:
+    return f"{_REQUEST_ID_PREFIX}{next(_request_counter):08x}"
+
+class RequestIdFilter(logging.Filter):
+    """Expose the current request ID to log formatters as %(request_id)s"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+class RequestTrackingMiddleware:
+    """
+    Assign a unique request ID (context variable + X-Request-ID header) and record request
+    duration and outcome in the API monitor, in a single ASGI pass.
+    """
+
+    def __init__(self, app, monitor):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = _next_request_id()
+        # Not reset afterwards: each request runs in its own task/context, and the global exception
+        # handler (in the outer ServerErrorMiddleware) still needs the ID after this middleware exits
+        request_id_var.set(request_id)
+        request_id_header = (b"x-request-id", request_id.encode("ascii"))
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), request_id_header]
+            await send(message)
+
+        start_time = time.perf_counter()
+        success = True
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            success = False
+            logger.error("Request failed: %s", e)
+            raise
+        finally:
+            duration = time.perf_counter() - start_time
+            self.monitor.record_request(duration, success)
+
+            # Log request details
+            logger.info(
+                "Request %s: %s %s - %.3fs - %s",
+                request_id, scope["method"], scope["path"], duration, "SUCCESS" if success else "FAILED",
+            )
@@ -1,39 +1,46 @@
 import asyncio
 import time
-from fastapi import HTTPException, Request
 import logging
+from backend.middleware.errors import send_error
 
 logger = logging.getLogger(__name__)
 
 class TimeoutMiddleware:
-    def __init__(self, timeout_seconds=60):
+    """Fail requests whose response has not started within the timeout"""
+
+    def __init__(self, app, timeout_seconds=60):
+        self.app = app
         self.timeout_seconds = timeout_seconds
     
-    async def __call__(self, request: Request, call_next):
+    async def __call__(self, scope, receive, send):
         """Timeout middleware implementation"""
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
         start_time = time.time()
-        
+        # The timeout covers time to first byte; once the response starts it is lifted
+        # so streamed bodies may run longer
+        timeout = asyncio.timeout(self.timeout_seconds)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                timeout.reschedule(None)
+            await send(message)
+
         try:
-            # Create a task with timeout
-            task = asyncio.create_task(call_next(request))
-            response = await asyncio.wait_for(task, timeout=self.timeout_seconds)
-            
+            async with timeout:
+                await self.app(scope, receive, send_wrapper)
+
             # Log request duration
             duration = time.time() - start_time
-            logger.info(f"Request completed in {duration:.2f}s: {request.method} {request.url.path}")
+            logger.info("Request completed in %.2fs: %s %s", duration, scope['method'], scope['path'])
             
-            return response
-            
-        except asyncio.TimeoutError:
-            logger.error(f"Request timeout after {self.timeout_seconds}s: {request.method} {request.url.path}")
-            raise HTTPException(
-                status_code=408,
-                detail=f"Request timeout after {self.timeout_seconds} seconds"
+        except TimeoutError:
+            logger.error("Request timeout after %ss: %s %s", self.timeout_seconds, scope['method'], scope['path'])
+            await send_error(
+                scope, receive, send, 408, f"Request timeout after {self.timeout_seconds} seconds"
             )
         except Exception as e:
             duration = time.time() - start_time
-            logger.error(f"Request failed after {duration:.2f}s: {str(e)}")
+            logger.error("Request failed after %.2fs: %s", duration, e)
             raise
-
-# Global timeout middleware instance
-timeout_middleware = TimeoutMiddleware(timeout_seconds=60) 
\ No newline at end of file
@@ -1,14 +1,31 @@
-from typing import Optional, Dict, Any
-from pydantic import BaseModel
+from typing import Optional, Dict, Any, Annotated
+from pydantic import BaseModel, ConfigDict, Field
 
 # --- Chat ---
+class GenerationParameters(BaseModel):
+    """Generation settings a client may override per request (unknown keys are dropped, instances are immutable)"""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+    # Bounded: every generation runs on a single worker, so one oversized request would stall all the others
+    max_new_tokens: Optional[Annotated[int, Field(ge=1, le=512)]] = None
+    repetition_penalty: Optional[Annotated[float, Field(gt=0, le=2)]] = None
+    do_sample: Optional[bool] = None
+    num_beams: Optional[Annotated[int, Field(ge=1, le=4)]] = None
+    temperature: Optional[Annotated[float, Field(ge=0, le=2)]] = None
+    top_p: Optional[Annotated[float, Field(gt=0, le=1)]] = None
+
 class ChatRequest(BaseModel):
-    message: str
+    model_config = ConfigDict(extra="ignore")
+
+    message: Annotated[str, Field(min_length=1, max_length=8192)]
     channel: str
     user_id: str
+    parameters: Optional[GenerationParameters] = None
 
 class ChatResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     response: str
     model: str
     timestamp: str
-    parameters_used: Dict[str, Any] 
\ No newline at end of file
+    parameters_used: Dict[str, Any]
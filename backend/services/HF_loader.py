@@ -8,25 +8,28 @@ import time
 import os
 from datetime import datetime
 import sys
-import threading
+from functools import lru_cache
+from importlib.util import find_spec
 
 # Third-Party Imports
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, TextStreamer
-from huggingface_hub import login
-from peft import PeftModel
+import psutil
 
 # --- Performance Optimization Configuration ---
-# Set environment variables for better CPU performance
+# One compute thread per physical core: GEMM throughput peaks there, and hyperthread siblings
+# (16 vCPUs = 8 cores x 2) only thrash the shared L1/L2. Set before torch loads its OpenMP runtime.
+NUM_THREADS = psutil.cpu_count(logical=False) or os.cpu_count() or 1
 os.environ["TOKENIZERS_PARALLELISM"] = "true"  # Enable parallel tokenization
-os.environ["OMP_NUM_THREADS"] = "16"  # Use all 16 VCPUs for OpenMP
-os.environ["MKL_NUM_THREADS"] = "16"  # Use all 16 VCPUs for MKL
-torch.set_num_threads(16)  # Set PyTorch to use all 16 threads
+os.environ.setdefault("OMP_NUM_THREADS", str(NUM_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(NUM_THREADS))
+os.environ.setdefault("OMP_PROC_BIND", "close")  # Keep each thread on its own core
+os.environ.setdefault("KMP_AFFINITY", "granularity=fine,compact,1,0")
 
-# --- Hugging Face Login ---
-# This authenticates with Hugging Face Hub to access private models or models requiring authentication
-# Required for downloading models from HF Hub
-login()
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM, TextStreamer, BitsAndBytesConfig
+from peft import PeftModel
+
+torch.set_num_threads(NUM_THREADS)
+torch.set_num_interop_threads(1)
 
 # --- Model and Tokenizer Configuration ---
 # Define the base model (original pre-trained model) and fine-tuned model identifiers
@@ -34,60 +37,201 @@ login()
 base_model_id = "mistralai/Mistral-7B-Instruct-v0.3"  # Original Mistral 7B model
 finetuned_model_id = "Pyzeur/Code-du-Travail-mistral-finetune"  # Fine-tuned version for French labor law
 
-print(f"🔄 Loading base model: {base_model_id}")
-start_time = time.time()
-
-# Load the base model with optimized settings for 16 VCPUs and 32GB RAM
-# Parameters explained:
-# - device_map="cpu": Forces model to run on CPU (slower but no GPU required)
-# - trust_remote_code=True: Allows execution of custom code from the model repository
-# - torch_dtype=torch.float16: Use half precision to reduce memory usage
-# - low_cpu_mem_usage=True: Optimize memory usage during loading
-base_model = AutoModelForCausalLM.from_pretrained(
-    base_model_id,
-    device_map="cpu",
-    trust_remote_code=True,
-    torch_dtype=torch.float16,  # Use half precision to save memory
-    low_cpu_mem_usage=True,  # Optimize memory usage
-)
-
-print(f"✅ Base model loaded in {time.time() - start_time:.2f} seconds")
-
-print(f"🔄 Loading fine-tuned model: {finetuned_model_id}")
-start_time = time.time()
-
-# Load the tokenizer from the fine-tuned model repository
-# The eval_tokenizer is a text processor that:
-# 1. Converts human text into numerical tokens the model can understand
-# 2. Converts model output tokens back into readable text
-# 3. Handles special tokens like <s>, </s>, [INST], [/INST], etc.
-# Parameters explained:
-# - add_bos_token=True: Automatically adds beginning-of-sequence token to inputs
-# - trust_remote_code=True: Allows custom tokenizer code execution
-eval_tokenizer = AutoTokenizer.from_pretrained(
-    finetuned_model_id,
-    add_bos_token=True,
-    trust_remote_code=True,
-)
-
-# --- Load the Fine-Tuned Model from Hugging Face Hub ---
-# PeftModel combines the base model with fine-tuning adapters
-# This allows using the fine-tuned weights without replacing the entire model
-ft_model = PeftModel.from_pretrained(base_model, finetuned_model_id)
-
-# --- CRITICAL: Merge the fine-tuned adapters with the base model ---
-# This ensures the fine-tuned weights are properly applied
-print("🔄 Merging fine-tuned adapters with base model...")
-ft_model = ft_model.merge_and_unload()
-
-print(f"✅ Fine-tuned model loaded and merged in {time.time() - start_time:.2f} seconds")
-
-# Set model to evaluation mode (disables dropout, batch norm updates)
-ft_model.eval()
+# Once the model is graph-optimized (IPEX or torch.compile), prompts are padded up to one of these lengths
+# so the optimized graphs see a handful of stable shapes; eager models get unpadded prompts
+PROMPT_LENGTH_BUCKETS = (64, 128, 256, 512, 1024)
+
+# Optional llama.cpp backend: path to a quantized GGUF export of the merged model, e.g. produced once with
+#   python convert_hf_to_gguf.py <merged_model_dir> --outfile model-f16.gguf
+#   llama-quantize model-f16.gguf model-Q4_K_M.gguf Q4_K_M
+# int4 weights cut the bytes streamed per decoded token ~4x compared to fp16 (requires llama-cpp-python)
+GGUF_MODEL_PATH = os.getenv("GGUF_MODEL_PATH")
+
+# Populated by load_model(); nothing is downloaded or loaded at import time
+ft_model = None
+eval_tokenizer = None
+llm = None
+pad_to_buckets = False
+
+def load_model(base_id=base_model_id, ft_id=finetuned_model_id, token=None):
+    """
+    Load the base model, merge the fine-tuned adapters into it and prepare it for inference.
+    
+    Args:
+        base_id (str): Hugging Face Hub ID of the base model
+        ft_id (str): Hugging Face Hub ID of the fine-tuned adapters (and tokenizer)
+        token (str, optional): Hugging Face token; defaults to the HF_TOKEN environment variable
+    """
+    global ft_model, eval_tokenizer, llm, pad_to_buckets
+    
+    if GGUF_MODEL_PATH:
+        from llama_cpp import Llama
+        print(f"🔄 Loading GGUF model: {GGUF_MODEL_PATH}")
+        start_time = time.time()
+        llm = Llama(model_path=GGUF_MODEL_PATH, n_ctx=2048, n_threads=NUM_THREADS, n_batch=512, verbose=False)
+        print(f"✅ GGUF model loaded in {time.time() - start_time:.2f} seconds")
+        return
+    
+    # --- Hugging Face Authentication ---
+    # The token is passed to each download instead of a global login(), which would prompt or read
+    # credentials as a side effect. Required for private models or models requiring authentication
+    token = token or os.environ.get("HF_TOKEN")
+    
+    print(f"🔄 Loading base model: {base_id}")
+    start_time = time.time()
+    
+    # Optional weight quantization through MODEL_DTYPE (same variable as the API service): "int8" or "int4"
+    # int8 halves and int4 quarters the ~13 GB fp16 weight footprint read on every decoded token.
+    # int8 is torch dynamic quantization of fp32 weights, applied after the adapters are merged (see below);
+    # int4 needs a bitsandbytes build with CPU support (multi-backend), the default one is CUDA-only.
+    quantization = os.getenv("MODEL_DTYPE", "bf16").lower()
+    torch_dtype = torch.float32 if quantization == "int8" else torch.bfloat16
+    if quantization == "int4":
+        if find_spec("bitsandbytes") is None or find_spec("bitsandbytes.backends") is None:
+            raise RuntimeError(
+                "MODEL_DTYPE=int4 on CPU requires the multi-backend bitsandbytes build; "
+                "use MODEL_DTYPE=int8 or a GGUF model (GGUF_MODEL_PATH) instead"
+            )
+        quantization_config = BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_compute_dtype=torch.bfloat16)
+    else:
+        quantization_config = None
+
+    # Load the base model with optimized settings for 16 VCPUs and 32GB RAM
+    # Parameters explained:
+    # - device_map="cpu": Forces model to run on CPU (slower but no GPU required)
+    # - trust_remote_code=True: Allows execution of custom code from the model repository
+    # - torch_dtype=torch.bfloat16: Half-size weights in the format x86 CPUs compute natively (AVX-512 BF16 / AMX);
+    #   fp16 matmuls are emulated through fp32 on most CPUs (fp32 when int8 quantization follows)
+    # - low_cpu_mem_usage=True: Optimize memory usage during loading
+    # - quantization_config: int4 weights when MODEL_DTYPE=int4 (adapters are merged into them below)
+    base_model = AutoModelForCausalLM.from_pretrained(
+        base_id,
+        device_map="cpu",
+        trust_remote_code=True,
+        torch_dtype=torch_dtype,
+        low_cpu_mem_usage=True,  # Optimize memory usage
+        quantization_config=quantization_config,
+        token=token,
+    )
+
+    print(f"✅ Base model loaded in {time.time() - start_time:.2f} seconds")
+
+    print(f"🔄 Loading fine-tuned model: {ft_id}")
+    start_time = time.time()
+
+    # Load the tokenizer from the fine-tuned model repository
+    # The eval_tokenizer is a text processor that:
+    # 1. Converts human text into numerical tokens the model can understand
+    # 2. Converts model output tokens back into readable text
+    # 3. Handles special tokens like <s>, </s>, [INST], [/INST], etc.
+    # Parameters explained:
+    # - add_bos_token=True: Automatically adds beginning-of-sequence token to inputs
+    # - trust_remote_code=True: Allows custom tokenizer code execution
+    # - use_fast=True: Rust-backed `tokenizers` implementation (much faster than the Python one)
+    # - padding_side="left": Prompts are padded on the left so generation continues right after them
+    eval_tokenizer = AutoTokenizer.from_pretrained(
+        ft_id,
+        add_bos_token=True,
+        trust_remote_code=True,
+        use_fast=True,
+        padding_side="left",
+        token=token,
+    )
+    if eval_tokenizer.pad_token is None:
+        eval_tokenizer.pad_token = eval_tokenizer.eos_token
+
+    # --- Load the Fine-Tuned Model from Hugging Face Hub ---
+    # PeftModel combines the base model with fine-tuning adapters
+    # This allows using the fine-tuned weights without replacing the entire model
+    ft_model = PeftModel.from_pretrained(base_model, ft_id, token=token)
+
+    # --- CRITICAL: Merge the fine-tuned adapters with the base model ---
+    # This ensures the fine-tuned weights are properly applied
+    print("🔄 Merging fine-tuned adapters with base model...")
+    ft_model = ft_model.merge_and_unload()
+
+    print(f"✅ Fine-tuned model loaded and merged in {time.time() - start_time:.2f} seconds")
+
+    # int8: quantize the Linear layers dynamically, now that the adapters are merged at full precision
+    if quantization == "int8":
+        ft_model = torch.ao.quantization.quantize_dynamic(ft_model, {torch.nn.Linear}, dtype=torch.qint8)
+        print("✅ Applied dynamic int8 quantization")
+
+    # Set model to evaluation mode (disables dropout, batch norm updates)
+    ft_model.eval()
+
+    # --- Graph-level optimizations for the decode loop ---
+    # Intel Extension for PyTorch (optional): fused bf16 kernels for rotary, attention and layernorm
+    # Only for plain bf16 weights: not for int8 (dynamically quantized Linear layers) or int4 (bitsandbytes)
+    graph_optimized = False
+    if quantization not in ("int8", "int4"):
+        try:
+            import intel_extension_for_pytorch as ipex
+            print("🔄 Optimizing model with Intel Extension for PyTorch (bf16)...")
+            ft_model = ipex.llm.optimize(ft_model, dtype=torch.bfloat16, inplace=True, deployment_mode=True)
+            graph_optimized = True
+        except ImportError:
+            pass
+
+    # torch.compile (opt-in, slow first start): compile forward so generate() runs the compiled graph
+    if os.getenv("TORCH_COMPILE", "0") == "1":
+        print("🔄 Compiling model with torch.compile...")
+        ft_model.forward = torch.compile(
+            ft_model.forward,
+            backend="inductor",
+            mode="reduce-overhead" if ft_model.device.type == "cuda" else "default",  # CUDA graphs need a GPU
+            fullgraph=False,
+        )
+        graph_optimized = True
+
+    pad_to_buckets = graph_optimized
+    tokenize_prompt.cache_clear()  # Cached encodings belong to the previous tokenizer and padding mode
+
+    # Warm up the two smallest prompt buckets plus the decode step before the first question
+    if graph_optimized:
+        for warmup_words in (1, 100):
+            warmup_input = tokenize_prompt("Bonjour " * warmup_words).to("cpu")
+            with torch.inference_mode():
+                ft_model.generate(**warmup_input, max_new_tokens=2, use_cache=True, pad_token_id=eval_tokenizer.eos_token_id)
+        print("✅ Model optimized and warmed up")
+
+@lru_cache(maxsize=4096)
+def tokenize_prompt(prompt):
+    """
+    Tokenize a prompt (cached for repeated questions), truncated to the largest bucket and, once the model
+    is graph-optimized, left-padded up to the nearest bucket length (padding only adds prefill work otherwise).
+    """
+    input_ids = eval_tokenizer(prompt, truncation=True, max_length=PROMPT_LENGTH_BUCKETS[-1])["input_ids"]
+    if pad_to_buckets:
+        padding = {"padding": "max_length", "max_length": next(b for b in PROMPT_LENGTH_BUCKETS if b >= len(input_ids))}
+    else:
+        padding = {"padding": "longest"}
+    return eval_tokenizer.pad({"input_ids": [input_ids]}, return_tensors="pt", **padding)
+
+def generate(prompt, **gen_kwargs):
+    """
+    Generate text for a raw prompt with the loaded model.
+    
+    Args:
+        prompt (str): The full prompt (including any instruction formatting)
+        **gen_kwargs: Generation parameters passed to model.generate (llm.create_completion for GGUF)
+        
+    Returns:
+        str: The decoded output
+    """
+    if llm is not None:
+        return llm.create_completion(prompt.removeprefix("<s>"), **gen_kwargs)["choices"][0]["text"]
+    if ft_model is None:
+        raise RuntimeError("Model not loaded. Call load_model() first.")
+    model_input = tokenize_prompt(prompt).to("cpu")
+    gen_kwargs.setdefault("pad_token_id", eval_tokenizer.eos_token_id)
+    with torch.inference_mode():
+        output = ft_model.generate(**model_input, **gen_kwargs)
+    return eval_tokenizer.decode(output[0], skip_special_tokens=True)
 
 def generate_response(user_question):
     """
-    Generate a response for a given user question with high-quality settings and a simple progress animation.
+    Generate a response for a given user question with high-quality settings, streaming the output with TextStreamer.
     
     Args:
         user_question (str): The question to ask the model
@@ -98,42 +242,32 @@ def generate_response(user_question):
     formatted_prompt = f"""<s>[INST] En tant qu'expert en droit du travail français, explique de façon précise et détaillée : {user_question} [/INST]"""
     print(f"\n🤖 Generating response for: '{user_question}' (high quality mode)")
     print("=" * 50)
-    model_input = eval_tokenizer(formatted_prompt, return_tensors="pt").to("cpu")
-
-    # Simple spinner animation to indicate progress
-    stop_spinner = False
-    def spinner():
-        symbols = ['|', '/', '-', '\\']
-        idx = 0
-        while not stop_spinner:
-            sys.stdout.write(f"\r⏳ Génération en cours... {symbols[idx % len(symbols)]}")
-            sys.stdout.flush()
-            idx += 1
-            time.sleep(0.15)
-        sys.stdout.write("\r" + " " * 40 + "\r")  # Clear the line
-        sys.stdout.flush()
+    if llm is not None:
+        return _generate_response_gguf(formatted_prompt)
+    model_input = tokenize_prompt(formatted_prompt).to("cpu")
 
-    spinner_thread = threading.Thread(target=spinner)
-    spinner_thread.start()
+    # Print tokens as they are decoded (runs inline in generate, no side thread)
+    streamer = TextStreamer(eval_tokenizer, skip_prompt=True, skip_special_tokens=True)
 
-    with torch.no_grad():
+    with torch.inference_mode():
         start_time = time.time()
-        try:
-            output = ft_model.generate(
-                **model_input,
-                max_new_tokens=300,
-                repetition_penalty=1.0,
-                do_sample=False,
-                num_beams=6,
-                temperature=0.3,
-                top_p=0.95,
-                pad_token_id=eval_tokenizer.eos_token_id,
-                num_return_sequences=1,
-                # No streamer here!
-            )
-        finally:
-            stop_spinner = True
-            spinner_thread.join()
+        output = ft_model.generate(
+            **model_input,
+            max_new_tokens=300,
+            repetition_penalty=1.0,
+            do_sample=False,
+            num_beams=1,  # Greedy: beam search multiplied per-step compute and KV cache by the beam count
+            temperature=0.3,
+            top_p=0.95,
+            pad_token_id=eval_tokenizer.eos_token_id,
+            num_return_sequences=1,
+            use_cache=True,  # Reuse past key/values between decoding steps
+            streamer=streamer,
+            # Stop at end of sequence or when the model starts a new [INST] turn instead of running to max_new_tokens
+            eos_token_id=eval_tokenizer.eos_token_id,
+            stop_strings=["[INST]"],
+            tokenizer=eval_tokenizer,
+        )
 
         generation_time = time.time() - start_time
         print(f"\n" + "=" * 50)
@@ -142,10 +276,35 @@ def generate_response(user_question):
         full_response = eval_tokenizer.decode(output[0], skip_special_tokens=True)
         return full_response
 
+def _generate_response_gguf(formatted_prompt):
+    """
+    Generate with the llama.cpp backend, printing tokens as they are produced.
+    """
+    start_time = time.time()
+    chunks = []
+    # Greedy decoding like the transformers path; the model adds <s> itself
+    for chunk in llm.create_completion(
+        formatted_prompt.removeprefix("<s>"),
+        max_tokens=300,
+        temperature=0.0,
+        repeat_penalty=1.0,
+        stream=True,
+    ):
+        text = chunk["choices"][0]["text"]
+        chunks.append(text)
+        sys.stdout.write(text)
+        sys.stdout.flush()
+    print(f"\n" + "=" * 50)
+    print(f"⏱️  Generation completed in {time.time() - start_time:.2f} seconds")
+    print(f"📊 Generated {len(chunks)} new tokens")
+    return "".join(chunks)
+
 def main():
     """
     Main interactive function for asking questions to the model.
     """
+    load_model()
+    
     print("\n" + "=" * 60)
     print("🤖 French Labor Law AI Assistant")
     print("=" * 60)
@@ -2,21 +2,27 @@
 # This script uses CUDA for inference if available.
 import time
 import os
-import sys
-import threading
+import copy
+import importlib.util
 from datetime import datetime
+from functools import lru_cache
 
 # Third-Party Imports
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, TextStreamer
-from huggingface_hub import login
-from peft import PeftModel
+import psutil
 
 # --- Performance Optimization Configuration ---
+# One CPU thread per physical core (set before torch loads its OpenMP runtime)
+NUM_THREADS = psutil.cpu_count(logical=False) or os.cpu_count() or 1
 os.environ["TOKENIZERS_PARALLELISM"] = "true"
-os.environ["OMP_NUM_THREADS"] = "16"
-os.environ["MKL_NUM_THREADS"] = "16"
-torch.set_num_threads(16)
+os.environ.setdefault("OMP_NUM_THREADS", str(NUM_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(NUM_THREADS))
+os.environ.setdefault("OMP_PROC_BIND", "close")
+
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM, TextStreamer, BitsAndBytesConfig
+from peft import PeftModel
+
+torch.set_num_threads(NUM_THREADS)
 
 # --- Device Selection ---
 if torch.cuda.is_available():
@@ -26,85 +32,224 @@ else:
     device = "cpu"
     print("⚠️  CUDA is not available. Using CPU for inference. (Performance will be lower)")
 
-# --- Hugging Face Login ---
-login()
+# --- Hugging Face Authentication ---
+# Token passed to each download (no interactive login() prompt, no extra network call at start)
+hf_token = os.getenv("HF_TOKEN")
 
 # --- Model and Tokenizer Configuration ---
 base_model_id = "mistralai/Mistral-7B-Instruct-v0.3"
 finetuned_model_id = "Pyzeur/Code-du-Travail-mistral-finetune"
+# Merged checkpoint written by export_merged_model.py: when present it is loaded directly (memory-mapped
+# safetensors) and the base model load + PEFT merge, which briefly holds two weight copies, are skipped
+merged_model_dir = os.getenv("MERGED_MODEL_DIR", "./merged_model")
+use_merged_model = os.path.isdir(merged_model_dir)
 
-print(f"🔄 Loading base model: {base_model_id}")
-start_time = time.time()
+# Optional 4-bit weights on GPU (MODEL_DTYPE=int4, requires bitsandbytes): NF4 with double quantization
+# shrinks the ~14 GB fp16 weights to ~4 GB, leaving the A2's memory for KV cache and larger batches
+quantize_4bit = device == "cuda" and os.getenv("MODEL_DTYPE", "fp16").lower() == "int4"
+if quantize_4bit:
+    quantization_config = BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_compute_dtype=torch.float16,
+        bnb_4bit_use_double_quant=True,
+    )
+else:
+    quantization_config = None
+
+# Fused attention kernels: FlashAttention-2 when flash-attn is installed (A2 is SM 8.6), otherwise PyTorch SDPA,
+# which picks flash / memory-efficient kernels itself; both avoid materializing the full score matrix
+if device == "cuda" and importlib.util.find_spec("flash_attn") is not None:
+    attn_implementation = "flash_attention_2"
+else:
+    attn_implementation = "sdpa"
 
-base_model = AutoModelForCausalLM.from_pretrained(
-    base_model_id,
-    device_map=device,
+model_kwargs = dict(
+    device_map="auto" if quantize_4bit else device,  # bitsandbytes places quantized weights itself
     trust_remote_code=True,
     torch_dtype=torch.float16 if device == "cuda" else torch.float32,
     low_cpu_mem_usage=True,
+    use_safetensors=True,
+    quantization_config=quantization_config,
+    attn_implementation=attn_implementation,
+    token=hf_token,
 )
-
-print(f"✅ Base model loaded in {time.time() - start_time:.2f} seconds")
-
-print(f"🔄 Loading fine-tuned model: {finetuned_model_id}")
-start_time = time.time()
-
-eval_tokenizer = AutoTokenizer.from_pretrained(
-    finetuned_model_id,
+tokenizer_kwargs = dict(
     add_bos_token=True,
     trust_remote_code=True,
+    use_fast=True,  # Rust-backed tokenizers implementation
+    token=hf_token,
 )
 
-ft_model = PeftModel.from_pretrained(base_model, finetuned_model_id)
-print("🔄 Merging fine-tuned adapters with base model...")
-ft_model = ft_model.merge_and_unload()
+# --- Loaded state, populated by load_model(); importing this module loads nothing ---
+ft_model = None
+eval_tokenizer = None
+vllm_engine = None
+generation_kwargs = {}
+PROMPT_PREFIX = "<s>[INST] En tant qu'expert en droit du travail français, explique de façon précise et détaillée :"
+prefix_ids = None
+prefix_cache = None
+
+def to_device(tensor):
+    """
+    Move a CPU tensor to the inference device; on CUDA it is staged in pinned memory so the copy is asynchronous.
+    """
+    if device == "cuda":
+        return tensor.pin_memory().to(device, non_blocking=True)
+    return tensor
+
+@lru_cache(maxsize=1)
+def load_model():
+    """
+    Load (once per process) the model, tokenizer and optional backends used by generate_response.
+    """
+    global ft_model, eval_tokenizer, vllm_engine, generation_kwargs, prefix_ids, prefix_cache
+
+    if use_merged_model:
+        print(f"🔄 Loading merged model: {merged_model_dir}")
+        start_time = time.time()
+        ft_model = AutoModelForCausalLM.from_pretrained(merged_model_dir, **model_kwargs)
+        eval_tokenizer = AutoTokenizer.from_pretrained(merged_model_dir, **tokenizer_kwargs)
+        print(f"✅ Merged model loaded in {time.time() - start_time:.2f} seconds (attention: {attn_implementation})")
+    else:
+        print(f"🔄 Loading base model: {base_model_id}")
+        start_time = time.time()
 
-print(f"✅ Fine-tuned model loaded and merged in {time.time() - start_time:.2f} seconds")
+        base_model = AutoModelForCausalLM.from_pretrained(base_model_id, **model_kwargs)
 
-ft_model.eval()
-ft_model.to(device)
+        print(f"✅ Base model loaded in {time.time() - start_time:.2f} seconds (attention: {attn_implementation})")
 
-def generate_response(user_question):
+        print(f"🔄 Loading fine-tuned model: {finetuned_model_id}")
+        start_time = time.time()
+
+        eval_tokenizer = AutoTokenizer.from_pretrained(finetuned_model_id, **tokenizer_kwargs)
+
+        ft_model = PeftModel.from_pretrained(base_model, finetuned_model_id, token=hf_token)
+        if quantize_4bit:
+            # Merging into NF4 weights would dequantize and requantize every adapted layer, rounding the
+            # fine-tuned weights; keep the adapters unmerged on top of the 4-bit base instead (or export a
+            # merged fp16 checkpoint with export_merged_model.py, which is then quantized after the merge)
+            print(f"✅ Fine-tuned adapters loaded (unmerged, 4-bit base) in {time.time() - start_time:.2f} seconds")
+        else:
+            print("🔄 Merging fine-tuned adapters with base model...")
+            ft_model = ft_model.merge_and_unload()
+            print(f"✅ Fine-tuned model loaded and merged in {time.time() - start_time:.2f} seconds")
+        del base_model  # Still referenced by ft_model (merge_and_unload() returns the same module)
+
+    ft_model.eval()
+    if not quantize_4bit:  # 4-bit models are already on the GPU and cannot be moved with .to()
+        ft_model.to(device)
+
+    # --- Optional vLLM backend (GPU only) ---
+    # INFERENCE_BACKEND=vllm serves the merged model with vLLM (paged KV cache, continuous batching)
+    # instead of transformers generate(). vLLM loads from disk, so the merged weights are saved once if needed.
+    if os.getenv("INFERENCE_BACKEND", "hf").lower() == "vllm" and device == "cuda" and not quantize_4bit:
+        from vllm import LLM
+
+        if not use_merged_model:
+            print(f"🔄 Saving merged model to {merged_model_dir} for vLLM...")
+            ft_model.save_pretrained(merged_model_dir, safe_serialization=True)
+            eval_tokenizer.save_pretrained(merged_model_dir)
+
+        # Free the transformers copy before vLLM claims most of the GPU memory
+        ft_model = None
+        torch.cuda.empty_cache()
+
+        print("🔄 Starting vLLM engine...")
+        vllm_engine = LLM(model=merged_model_dir, dtype="float16", gpu_memory_utilization=0.9, max_model_len=2048)
+        print("✅ vLLM engine ready")
+
+    # --- Generation settings (shared by the warmup and generate_response) ---
+    generation_kwargs = dict(
+        max_new_tokens=300,
+        repetition_penalty=1.0,
+        do_sample=False,
+        num_beams=1,  # Greedy: beam search multiplied per-step compute and KV cache by the beam count
+        temperature=0.3,
+        top_p=0.95,
+        pad_token_id=eval_tokenizer.eos_token_id,
+        num_return_sequences=1,
+    )
+
+    # --- Optional assisted (speculative) decoding ---
+    # DRAFT_MODEL_ID names a small draft model sharing Mistral's tokenizer; it proposes several tokens
+    # per step that the 7B model verifies in a single forward pass (output is identical to greedy decoding)
+    draft_model_id = os.getenv("DRAFT_MODEL_ID")
+    if vllm_engine is None and draft_model_id:
+        print(f"🔄 Loading draft model: {draft_model_id}")
+        assistant_model = AutoModelForCausalLM.from_pretrained(
+            draft_model_id,
+            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+            low_cpu_mem_usage=True,
+        ).to(device)
+        assistant_model.eval()
+        generation_kwargs["assistant_model"] = assistant_model
+
+    # --- Optional torch.compile (TORCH_COMPILE=1) ---
+    # A static KV cache keeps decode-step shapes fixed so the compiled forward is reused (and captured
+    # as CUDA graphs on GPU) instead of dispatching every kernel from Python on each token
+    if vllm_engine is None and os.getenv("TORCH_COMPILE", "0") == "1":
+        print("🔄 Compiling model with torch.compile...")
+        generation_kwargs["cache_implementation"] = "static"
+        ft_model.forward = torch.compile(
+            ft_model.forward,
+            mode="reduce-overhead" if device == "cuda" else "default",  # CUDA graphs need a GPU
+            fullgraph=not quantize_4bit,  # bitsandbytes kernels cause graph breaks
+            dynamic=False,
+        )
+        # Pay the compile cost now rather than on the first question
+        start_time = time.time()
+        warmup_input = eval_tokenizer("<s>[INST] Bonjour [/INST]", return_tensors="pt").to(device)
+        with torch.inference_mode():
+            ft_model.generate(**warmup_input, **generation_kwargs)
+        print(f"✅ Model compiled and warmed up in {time.time() - start_time:.2f} seconds")
+
+    # --- Prompt prefix KV cache ---
+    # Every question shares the same instruction prefix: run its prefill once and start each generation
+    # from a copy of its key/value cache. Not combined with the static cache or assisted decoding,
+    # which manage their own caches.
+    if vllm_engine is None and not {"cache_implementation", "assistant_model"} & generation_kwargs.keys():
+        prefix_ids = eval_tokenizer(PROMPT_PREFIX, return_tensors="pt").input_ids.to(device)
+        with torch.inference_mode():
+            prefix_cache = ft_model(prefix_ids, use_cache=True).past_key_values
+
+def generate_response(user_question, **gen_overrides):
     """
-    Generate a response for a given user question with high-quality settings and a simple progress animation.
+    Generate a response for a given user question, printing tokens as they are produced.
+    The model is loaded on first use; keyword arguments override the default generation settings
+    (e.g. max_new_tokens=150 for a faster answer).
     """
+    load_model()
     formatted_prompt = f"""<s>[INST] En tant qu'expert en droit du travail français, explique de façon précise et détaillée : {user_question} [/INST]"""
     print(f"\n🤖 Generating response for: '{user_question}' (high quality mode)")
     print("=" * 50)
-    model_input = eval_tokenizer(formatted_prompt, return_tensors="pt").to(device)
-
-    stop_spinner = False
-    def spinner():
-        symbols = ['|', '/', '-', '\\']
-        idx = 0
-        while not stop_spinner:
-            sys.stdout.write(f"\r⏳ Génération en cours... {symbols[idx % len(symbols)]}")
-            sys.stdout.flush()
-            idx += 1
-            time.sleep(0.15)
-        sys.stdout.write("\r" + " " * 40 + "\r")
-        sys.stdout.flush()
-
-    spinner_thread = threading.Thread(target=spinner)
-    spinner_thread.start()
-
-    with torch.no_grad():
+    if vllm_engine is not None:
+        from vllm import SamplingParams
         start_time = time.time()
-        try:
-            output = ft_model.generate(
-                **model_input,
-                max_new_tokens=300,
-                repetition_penalty=1.0,
-                do_sample=False,
-                num_beams=6,
-                temperature=0.3,
-                top_p=0.95,
-                pad_token_id=eval_tokenizer.eos_token_id,
-                num_return_sequences=1,
-            )
-        finally:
-            stop_spinner = True
-            spinner_thread.join()
+        # Greedy decoding, same as the transformers path below
+        max_tokens = gen_overrides.get("max_new_tokens", generation_kwargs["max_new_tokens"])
+        result = vllm_engine.generate([formatted_prompt], SamplingParams(max_tokens=max_tokens, temperature=0.0))[0]
+        print(f"⏱️  Generation completed in {time.time() - start_time:.2f} seconds")
+        print(f"📊 Generated {len(result.outputs[0].token_ids)} new tokens")
+        return result.outputs[0].text
+
+    model_input = {k: to_device(v) for k, v in eval_tokenizer(formatted_prompt, return_tensors="pt").items()}
+    cache_kwargs = {}
+    if prefix_cache is not None:
+        # The whole prompt is tokenized once (tokenizing the question on its own changes its leading-space
+        # token); when it starts with the cached prefix ids, generate() resumes from a private copy of the
+        # prefix cache and only runs prefill on the remaining tokens. Otherwise the uncached path is used.
+        input_ids = model_input["input_ids"]
+        prefix_length = prefix_ids.shape[-1]
+        if input_ids.shape[-1] > prefix_length and torch.equal(input_ids[:, :prefix_length], prefix_ids):
+            cache_kwargs = {"past_key_values": copy.deepcopy(prefix_cache)}
+
+    # Print tokens as they are decoded (runs inline in generate, no side thread)
+    streamer = TextStreamer(eval_tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+    with torch.inference_mode():
+        start_time = time.time()
+        output = ft_model.generate(**model_input, **(generation_kwargs | gen_overrides), **cache_kwargs, streamer=streamer)
 
         generation_time = time.time() - start_time
         print(f"\n" + "=" * 50)
@@ -114,6 +259,8 @@ def generate_response(user_question):
         return full_response
 
 def main():
+    load_model()
+    
     print("\n" + "=" * 60)
     print("🤖 French Labor Law AI Assistant (GPU Optimized)")
     print("=" * 60)
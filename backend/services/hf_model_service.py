@@ -2,10 +2,93 @@ import time
 import os
 from datetime import datetime
 import threading
+import shutil
+import copy
+import ctypes
+import gc
+import hashlib
+import orjson
+from collections import OrderedDict
+from functools import lru_cache
+from importlib.util import find_spec
+import psutil
+
+# One compute thread per physical core the process may run on (respects container/taskset CPU limits).
+# OpenMP/MKL read these once when torch loads them, so they must be set before the import below.
+# sched_getaffinity is Linux-only; elsewhere every CPU counts as usable.
+_USABLE_CPUS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+NUM_THREADS = min(psutil.cpu_count(logical=False) or os.cpu_count() or 1, _USABLE_CPUS)
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+os.environ.setdefault("OMP_NUM_THREADS", str(NUM_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(NUM_THREADS))
+
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from huggingface_hub import login
+from transformers import (
+    AutoTokenizer, AutoModelForCausalLM, AsyncTextIteratorStreamer, DynamicCache, StoppingCriteria, StoppingCriteriaList,
+)
+from huggingface_hub import snapshot_download
+from huggingface_hub.errors import LocalEntryNotFoundError
 from peft import PeftModel
+from backend.config import settings
+
+# Weight precisions selectable through the MODEL_DTYPE environment variable
+TORCH_DTYPES = {
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+    "fp32": torch.float32,
+}
+QUANTIZED_DTYPES = ("int8", "int4")
+
+torch.set_num_threads(NUM_THREADS)
+torch.set_num_interop_threads(max(1, NUM_THREADS // 4))
+
+# Attention kernel: fused scaled_dot_product_attention by default ("eager" for models without SDPA support)
+ATTN_IMPLEMENTATION = os.getenv("ATTN_IMPLEMENTATION", "sdpa")
+
+# Maximum number of deterministic responses kept in the in-memory LRU cache
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+
+# KV cache reuse for prompts sharing their first PREFIX_CACHE_TOKENS tokens (e.g. a common system prompt);
+# 0 disables it. Up to PREFIX_CACHE_SIZE distinct prefixes are kept.
+PREFIX_CACHE_TOKENS = int(os.getenv("PREFIX_CACHE_TOKENS", "0"))
+PREFIX_CACHE_SIZE = 8
+
+# Files fetched from a model repository: sharded transformers weights, adapter weights, configs and
+# tokenizer files (skips duplicate checkpoints such as Mistral's consolidated.safetensors)
+HUB_ALLOW_PATTERNS = ["model*.safetensors", "adapter_model.safetensors", "*.json", "tokenizer*"]
+HUB_DOWNLOAD_WORKERS = 8
+
+# Longer prompts are truncated before generation
+MAX_PROMPT_TOKENS = 2048
+
+# Once the model is compiled, prompts are left-padded up to one of these lengths so the compiled
+# prefill sees a handful of stable shapes instead of one per prompt length
+PROMPT_LENGTH_BUCKETS = (128, 256, 512, 1024, MAX_PROMPT_TOKENS)
+
+# Batched prompts are split into buckets whose longest/shortest token length stays within this ratio
+LENGTH_BUCKET_RATIO = 1.5
+
+def _release_memory():
+    """
+    Free the memory of dropped model weights now, and hand it back to the OS, so that loading the next model
+    doesn't briefly hold two copies.
+    """
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)  # glibc keeps freed arenas mapped otherwise
+    except (OSError, AttributeError):
+        pass
+
+class _StopOnEvent(StoppingCriteria):
+    """Stop generation once the given threading.Event is set."""
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
 
 class HFModelService:
     """
@@ -31,10 +114,17 @@ class HFModelService:
         # Model and tokenizer objects
         self.model = None
         self.tokenizer = None
+        # Optional small model sharing the tokenizer, used for assisted (speculative) decoding
+        self.draft_model = None
+        # Set when load_model(compile=True) compiled the model; padded prompt shapes are then kept stable
+        self._compiled = False
         self.model_id = None
         self.base_model_id = None
         self.finetuned_model_id = None
         self.device = "cpu"  # Change to "cuda" if GPU is available
+        # Shared on-disk Hub cache (the mounted MODEL_CACHE_DIR volume unless a Hub cache is configured),
+        # so restarts and other processes reuse downloaded weights instead of fetching them again
+        self.cache_dir = os.getenv("HF_HUB_CACHE") or os.getenv("HUGGINGFACE_HUB_CACHE") or settings.MODEL_CACHE_DIR
         # Default generation parameters (can be updated per request)
         self.parameters = {
             "max_new_tokens": 150,  # Reduced from 300 for faster responses
@@ -49,62 +139,109 @@ class HFModelService:
         self.last_loaded = None
         self.last_unloaded = None
         self.last_parameters_update = None
-        # Performance optimization for multi-core CPUs
-        os.environ["TOKENIZERS_PARALLELISM"] = "true"
-        os.environ["OMP_NUM_THREADS"] = "16"
-        os.environ["MKL_NUM_THREADS"] = "16"
-        torch.set_num_threads(16)
-        # Login to Hugging Face Hub (token should be set in env or config)
-        login(token=os.getenv("HF_TOKEN"))
+        # Incremented whenever the loaded model or parameters change (lets callers cache derived data)
+        self.state_version = 0
+        # Defaults with None values removed, rebuilt only when parameters change
+        self._default_generation_params = None
+        # Exact-match cache of deterministic responses, cleared whenever the model changes
+        self._response_cache = OrderedDict()
+        self._response_cache_lock = threading.Lock()
+        # Prefilled KV caches of shared prompt prefixes, keyed by their token ids
+        self._prefix_cache = OrderedDict()
+        # Hugging Face Hub token (env or config), passed to each download instead of a global login()
+        self.token = os.getenv("HF_TOKEN") or settings.HF_TOKEN or None
 
-    def load_model(self, base_model_id: str, finetuned_model_id: str = None, config: dict = None):
+    def load_model(self, base_model_id: str, finetuned_model_id: str = None, config: dict = None, compile: bool = False):
         """
         Load a base model and optionally a fine-tuned adapter (PEFT/LoRA) from Hugging Face Hub.
         This logic handles vocabulary size mismatches and falls back to base model if adapter fails.
+        The model is built (merged, quantized, optionally compiled with compile=True) in local variables and
+        only published to the service once complete, so concurrent requests never see a partial model.
         """
         self.unload_model()  # Always unload previous model
-        self.base_model_id = base_model_id
-        self.finetuned_model_id = finetuned_model_id
         
         try:
-            # Always load base model from Hugging Face Hub
-            self.model = AutoModelForCausalLM.from_pretrained(
-                base_model_id,
-                device_map=self.device,
+            # Fetch repositories up front with parallel downloads; loading then reads the local snapshots
+            base_model_path = self._snapshot(base_model_id)
+            finetuned_model_path = self._snapshot(finetuned_model_id) if finetuned_model_id else None
+            
+            precision_kwargs = self._precision_kwargs()
+            # Merged base+adapter weights from a previous load, if cached (see _merged_model_path)
+            merged_model_path = None
+            if finetuned_model_id:
+                merged_model_path = self._merged_model_path(base_model_path, finetuned_model_path, precision_kwargs)
+            use_merged_cache = merged_model_path is not None and os.path.isfile(os.path.join(merged_model_path, "config.json"))
+            
+            # Load the cached merged model (memory-mapped safetensors, no adapter merge) or the base model
+            model = AutoModelForCausalLM.from_pretrained(
+                merged_model_path if use_merged_cache else base_model_path,
                 trust_remote_code=True,
-                torch_dtype=torch.float16,
                 low_cpu_mem_usage=True,
+                use_safetensors=True,
+                attn_implementation=ATTN_IMPLEMENTATION,
+                **precision_kwargs,
             )
+            if use_merged_cache:
+                print(f"Loaded cached merged model: {merged_model_path}")
+            # Quantized weights are placed by accelerate; follow them for input tensors
+            device = str(model.device)
             
             # Always load tokenizer from finetuned model if present, else from base
             tokenizer_id = finetuned_model_id if finetuned_model_id else base_model_id
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                tokenizer_id,
+            tokenizer_path = finetuned_model_path if finetuned_model_id else base_model_path
+            # Fast (Rust) tokenizer, left-padded so batched generation starts right after each prompt.
+            # Loaded once here and shared by the single, batched and streaming generation paths.
+            tokenizer = AutoTokenizer.from_pretrained(
+                tokenizer_path,
                 add_bos_token=True,
                 trust_remote_code=True,
+                use_fast=True,
+                padding_side="left",
             )
+            if not tokenizer.is_fast:
+                print(f"Warning: no fast tokenizer available for {tokenizer_id}, falling back to the slow Python one")
+            # Ensure pad_token_id is set for generation
+            if tokenizer.pad_token_id is None:
+                tokenizer.pad_token_id = tokenizer.eos_token_id
             
             # If finetuned model, try to load adapter and merge with base model
-            if finetuned_model_id:
+            if finetuned_model_id and not use_merged_cache:
                 try:
                     print(f"Attempting to load adapter: {finetuned_model_id}")
-                    adapter = PeftModel.from_pretrained(self.model, finetuned_model_id)
-                    self.model = adapter.merge_and_unload()
+                    adapter = PeftModel.from_pretrained(model, finetuned_model_path)
+                    model = adapter.merge_and_unload()
                     print(f"Successfully loaded and merged adapter: {finetuned_model_id}")
+                    if merged_model_path:
+                        self._save_merged_model(model, merged_model_path)
                 except Exception as adapter_error:
                     print(f"Failed to load adapter {finetuned_model_id}: {str(adapter_error)}")
                     print("Falling back to base model only")
                     # Keep the base model and tokenizer, but don't use the adapter
-                    self.finetuned_model_id = None
+                    finetuned_model_id = None
             
-            self.model.eval()
-            self.model_id = self.finetuned_model_id or base_model_id
-            self.last_loaded = datetime.utcnow().isoformat() + "Z"
+            # CPU int8: quantize the Linear layers dynamically, after the adapter has been merged at full precision
+            if self._use_dynamic_int8():
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                print("Applied dynamic int8 quantization")
             
-            # Ensure pad_token_id is set for generation
-            if self.tokenizer.pad_token_id is None:
-                self.tokenizer.pad_token_id = self.tokenizer.eos_token_id
-            self.parameters["pad_token_id"] = self.tokenizer.pad_token_id
+            model.eval()
+            draft_model = self._load_draft_model(model, device)
+            compiled = compile and self._compile_forward(model, tokenizer, device)
+            
+            # Publish: generation settings first, the model and tokenizer last (is_model_loaded() turns True)
+            self.parameters["pad_token_id"] = tokenizer.pad_token_id
+            self._default_generation_params = None
+            self.clear_response_cache()
+            self.device = device
+            self.draft_model = draft_model
+            self._compiled = compiled
+            self.base_model_id = base_model_id
+            self.finetuned_model_id = finetuned_model_id
+            self.model_id = finetuned_model_id or base_model_id
+            self.model = model
+            self.tokenizer = tokenizer
+            self.last_loaded = datetime.utcnow().isoformat() + "Z"
+            self.state_version += 1
             
             print(f"Model loaded successfully: {self.model_id}")
             
@@ -114,16 +251,171 @@ class HFModelService:
             self.unload_model()
             raise e
 
+    def _load_draft_model(self, model, device: str):
+        """
+        Load the draft model named by DRAFT_MODEL_ID, if set, for assisted decoding. It must use the same
+        tokenizer as the main model; returns None when unset or on failure (generation then runs without it).
+        """
+        draft_model_id = os.getenv("DRAFT_MODEL_ID")
+        if not draft_model_id:
+            return None
+        try:
+            print(f"Loading draft model: {draft_model_id}")
+            return AutoModelForCausalLM.from_pretrained(
+                self._snapshot(draft_model_id),
+                low_cpu_mem_usage=True,
+                use_safetensors=True,
+                attn_implementation=ATTN_IMPLEMENTATION,
+                torch_dtype=model.dtype,
+                device_map=device,
+            ).eval()
+        except Exception as e:
+            print(f"Failed to load draft model {draft_model_id}: {str(e)}")
+            print("Continuing without assisted decoding")
+            return None
+
+    def _snapshot(self, repo_id: str) -> str:
+        """
+        Download the files needed from a Hub repository (concurrently, reusing the local cache) and return the local path.
+        """
+        download_kwargs = dict(
+            cache_dir=self.cache_dir,
+            token=self.token,
+            allow_patterns=HUB_ALLOW_PATTERNS,
+            max_workers=HUB_DOWNLOAD_WORKERS,
+        )
+        # Warm path: an already cached snapshot is used without any Hub API round-trip, provided it is complete
+        # (refs/main is written before the files, so an interrupted download leaves a partial snapshot behind)
+        try:
+            local_path = snapshot_download(repo_id, local_files_only=True, **download_kwargs)
+            if self._snapshot_complete(local_path):
+                return local_path
+        except LocalEntryNotFoundError:
+            pass
+        return snapshot_download(repo_id, **download_kwargs)
+
+    @staticmethod
+    def _snapshot_complete(path: str) -> bool:
+        """
+        Whether a local snapshot holds a config and every weight file it needs (all shards of a sharded model).
+        """
+        def present(name):
+            return os.path.isfile(os.path.join(path, name))
+
+        if present("adapter_config.json"):
+            return present("adapter_model.safetensors")
+        if not present("config.json"):
+            return False
+        if present("model.safetensors.index.json"):
+            with open(os.path.join(path, "model.safetensors.index.json"), "rb") as f:
+                shards = set(orjson.loads(f.read())["weight_map"].values())
+            return all(present(shard) for shard in shards)
+        return present("model.safetensors")
+
+    def _merged_model_path(self, base_model_path: str, finetuned_model_path: str, precision_kwargs: dict):
+        """
+        Disk location of the merged model for this base/adapter pair, keyed by their snapshot commit hashes
+        and the weight dtype; None when merged models aren't cached (disabled, or quantized weights).
+        """
+        if os.getenv("MERGED_MODEL_CACHE", "1") != "1" or "quantization_config" in precision_kwargs:
+            return None
+        base_sha = os.path.basename(base_model_path.rstrip(os.sep))
+        adapter_sha = os.path.basename(finetuned_model_path.rstrip(os.sep))
+        dtype = str(precision_kwargs["torch_dtype"]).removeprefix("torch.")
+        return os.path.join(self.cache_dir, "merged", f"{base_sha[:12]}-{adapter_sha[:12]}-{dtype}")
+
+    def _save_merged_model(self, model, merged_model_path: str):
+        """
+        Save the merged model as safetensors so later loads skip the adapter merge. Failures are not fatal.
+        """
+        tmp_path = merged_model_path + ".tmp"
+        try:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            model.save_pretrained(tmp_path, safe_serialization=True)
+            os.replace(tmp_path, merged_model_path)  # Only a complete checkpoint becomes visible
+            print(f"Cached merged model: {merged_model_path}")
+        except Exception as e:
+            print(f"Could not cache merged model: {str(e)}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _precision_kwargs(self) -> dict:
+        """
+        Build the from_pretrained arguments for the weight precision selected by MODEL_DTYPE
+        (fp16, bf16, fp32, int8 or int4; defaults to bf16). int4 (NF4) requires bitsandbytes; int8 uses
+        bitsandbytes on GPU and torch dynamic quantization of fp32 weights on CPU (see load_model).
+        """
+        model_dtype = os.getenv("MODEL_DTYPE", "bf16").lower()
+        if self._use_dynamic_int8():
+            return {"torch_dtype": torch.float32, "device_map": self.device}
+        if model_dtype in QUANTIZED_DTYPES:
+            from transformers import BitsAndBytesConfig
+            if model_dtype == "int8":
+                quantization_config = BitsAndBytesConfig(load_in_8bit=True)
+            else:
+                quantization_config = BitsAndBytesConfig(
+                    load_in_4bit=True,
+                    bnb_4bit_quant_type="nf4",
+                    bnb_4bit_compute_dtype=torch.bfloat16,
+                )
+            return {
+                "quantization_config": quantization_config,
+                "torch_dtype": torch.bfloat16,
+                "device_map": "auto",
+            }
+        if model_dtype not in TORCH_DTYPES:
+            raise ValueError(f"Unsupported MODEL_DTYPE '{model_dtype}'. Expected one of: {', '.join([*TORCH_DTYPES, *QUANTIZED_DTYPES])}")
+        return {"torch_dtype": TORCH_DTYPES[model_dtype], "device_map": self.device}
+
+    def _use_dynamic_int8(self) -> bool:
+        """
+        Whether int8 weights come from torch dynamic quantization (CPU, or bitsandbytes not installed).
+        """
+        if os.getenv("MODEL_DTYPE", "bf16").lower() != "int8":
+            return False
+        return self.device == "cpu" or find_spec("bitsandbytes") is None
+
+    def _compile_forward(self, model, tokenizer, device: str, warmup_prompt: str = "Bonjour") -> bool:
+        """
+        Compile a model's forward pass with torch.compile and run a warmup generation so the graph is traced
+        before the first real request. Returns False (eager forward restored) if compilation fails.
+        """
+        # Compile forward rather than the module: generate() is looked up on the original
+        # model and would otherwise bypass a compiled wrapper entirely.
+        # CUDA graphs ("reduce-overhead") only exist on GPU; dynamic shapes avoid a recompile per prompt length.
+        eager_forward = model.forward
+        mode = "reduce-overhead" if device.startswith("cuda") else "default"
+        try:
+            model.forward = torch.compile(eager_forward, mode=mode, fullgraph=False, dynamic=True)
+            # Warm up with the padded shape real requests get once compiled (see _pad_prompts)
+            warmup_input = tokenizer.pad(
+                {"input_ids": [tokenizer(warmup_prompt)["input_ids"]]},
+                padding="max_length",
+                max_length=PROMPT_LENGTH_BUCKETS[0],
+                return_tensors="pt",
+            ).to(device)
+            with torch.inference_mode():
+                model.generate(**warmup_input, max_new_tokens=8, pad_token_id=tokenizer.pad_token_id)
+            return True
+        except Exception as e:
+            print(f"torch.compile failed, falling back to eager execution: {str(e)}")
+            model.forward = eager_forward
+            return False
+
     def unload_model(self):
         """
         Unload the current model and tokenizer from memory. Frees up resources.
         """
         self.model = None
         self.tokenizer = None
+        self.draft_model = None
+        self._compiled = False
         self.model_id = None
         self.base_model_id = None
         self.finetuned_model_id = None
         self.last_unloaded = datetime.utcnow().isoformat() + "Z"
+        self.state_version += 1
+        self.clear_response_cache()
+        _release_memory()
 
     def is_model_loaded(self) -> bool:
         """
@@ -154,38 +446,224 @@ class HFModelService:
         
         print("Model is loaded, proceeding with generation...")
         
-        prompt = message
-        print(f"Using prompt: '{prompt[:50]}...'")
-        
-        # Tokenize input and move to correct device
-        print("Tokenizing input...")
-        model_input = self.tokenizer(prompt, return_tensors="pt").to(self.device)
-        print(f"Input tokens shape: {model_input['input_ids'].shape}")
-        
         # Merge provided parameters with defaults
-        params = self.parameters.copy()
-        if parameters:
-            params.update(parameters)
-        
-        # Remove None values (required by HF generate)
-        params = {k: v for k, v in params.items() if v is not None}
+        params = self._generation_params(parameters)
         print(f"Final generation parameters: {params}")
         
-        print("Starting generation...")
-        with torch.no_grad():
-            output = self.model.generate(
-                **model_input,
-                **params
-            )
+        cached = self.get_cached_response(message, params)
+        if cached is not None:
+            print("Serving response from cache")
+            return cached
         
-        print(f"Generation complete. Output shape: {output.shape}")
-        response = self.tokenizer.decode(output[0], skip_special_tokens=True)
+        # A batch of one: shares the fast batched tokenization and generation path
+        print("Starting generation...")
+        response = self.generate_batch([message], params)[0]
         print(f"Decoded response length: {len(response)}")
         print(f"Response preview: '{response[:100]}...'")
         print(f"=== HF MODEL SERVICE: generate_response completed ===")
         
+        self.cache_response(message, params, response)
         return response
 
+    def generate_stream(self, message: str, parameters: dict = None, executor=None,
+                        stop_event: threading.Event = None) -> AsyncTextIteratorStreamer:
+        """
+        Start generating a response in the background and return a streamer yielding text chunks.
+        Must be called from the event loop the streamer will be consumed on.
+        Args:
+            message (str): The input prompt or user message.
+            parameters (dict, optional): Generation parameters to override defaults.
+            executor (Executor, optional): Executor to run generation on (shared with batched generation so the
+                two never run concurrently on the model); a dedicated thread is used when omitted.
+            stop_event (threading.Event, optional): Set it to stop generation early (e.g. the client went away).
+        Returns:
+            AsyncTextIteratorStreamer: Async iterator over decoded text chunks as they are produced.
+        Raises:
+            RuntimeError: If no model is loaded.
+        """
+        if not self.is_model_loaded():
+            raise RuntimeError("No model loaded. Please ensure the model is loaded before making inference requests.")
+
+        params = self._generation_params(parameters)
+        streamer = AsyncTextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        stop_event = stop_event or threading.Event()
+
+        def run():
+            if stop_event.is_set():
+                # Abandoned while still queued behind other generations
+                streamer.end()
+                return
+            # Tokenization and the prefix prefill run here too, on the generation thread, not the caller's
+            try:
+                input_ids = self.tokenizer(message, truncation=True, max_length=MAX_PROMPT_TOKENS)["input_ids"]
+                self.model.generate(
+                    **self._pad_prompts([input_ids]),
+                    **self._assisted_params(params, 1),
+                    **self._prefix_cache_kwargs(input_ids),
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([_StopOnEvent(stop_event)]),
+                )
+            except BaseException:
+                # A failed generation never ends the stream itself; close it so the consumer isn't left waiting
+                streamer.end()
+                raise
+
+        if executor is None:
+            threading.Thread(target=run, daemon=True).start()
+        else:
+            executor.submit(run)
+        return streamer
+
+    def generate_batch(self, messages: list, parameters: dict = None) -> list:
+        """
+        Generate responses for several messages with a single padded forward pass.
+        Args:
+            messages (list): The input prompts or user messages.
+            parameters (dict, optional): Generation parameters to override defaults.
+        Returns:
+            list: The generated response texts, in the same order as messages.
+        Raises:
+            RuntimeError: If no model is loaded.
+        """
+        if not self.is_model_loaded():
+            raise RuntimeError("No model loaded. Please ensure the model is loaded before making inference requests.")
+
+        params = self._generation_params(parameters)
+
+        # Tokenize once, then group prompts of similar length so padding stays small
+        input_ids = self.tokenizer(
+            messages, add_special_tokens=True, truncation=True, max_length=MAX_PROMPT_TOKENS
+        )["input_ids"]
+        buckets = []
+        for i in sorted(range(len(messages)), key=lambda i: len(input_ids[i])):
+            if buckets and len(input_ids[i]) <= LENGTH_BUCKET_RATIO * len(input_ids[buckets[-1][0]]):
+                buckets[-1].append(i)
+            else:
+                buckets.append([i])
+
+        responses = [None] * len(messages)
+        for bucket in buckets:
+            model_input = self._pad_prompts([input_ids[i] for i in bucket])
+
+            prefix_kwargs = self._prefix_cache_kwargs(input_ids[bucket[0]]) if len(bucket) == 1 else {}
+            with torch.inference_mode():
+                output = self.model.generate(
+                    **model_input,
+                    **self._assisted_params(params, len(bucket)),
+                    **prefix_kwargs
+                )
+
+            # Scatter results back to the original request order
+            for i, text in zip(bucket, self.tokenizer.batch_decode(output, skip_special_tokens=True)):
+                responses[i] = text
+
+        return responses
+
+    def _pad_prompts(self, input_ids: list):
+        """
+        Left-pad tokenized prompts into a batch: to the longest prompt, or to its PROMPT_LENGTH_BUCKETS
+        length once the model is compiled.
+        """
+        longest = max(len(ids) for ids in input_ids)
+        if self._compiled:
+            padding = {"padding": "max_length", "max_length": next(b for b in PROMPT_LENGTH_BUCKETS if b >= longest)}
+        else:
+            padding = {"padding": "longest"}
+        return self.tokenizer.pad({"input_ids": input_ids}, return_tensors="pt", **padding).to(self.device)
+
+    def _generation_params(self, parameters: dict = None) -> dict:
+        """
+        Merge provided parameters with the cached defaults, dropping None values (required by HF generate).
+        """
+        if self._default_generation_params is None:
+            self._default_generation_params = {k: v for k, v in self.parameters.items() if v is not None}
+        if not parameters:
+            return self._default_generation_params
+        return self._default_generation_params | {k: v for k, v in parameters.items() if v is not None}
+
+    def _assisted_params(self, params: dict, batch_size: int) -> dict:
+        """
+        Add the draft model to the generation parameters when assisted decoding applies
+        (a loaded draft model, a single prompt and a single beam).
+        """
+        if self.draft_model is None or batch_size != 1 or params.get("num_beams", 1) != 1:
+            return params
+        return params | {"assistant_model": self.draft_model}
+
+    def _prefix_cache_kwargs(self, input_ids: list) -> dict:
+        """
+        Return generate() arguments reusing the KV cache of the prompt's first PREFIX_CACHE_TOKENS tokens,
+        prefilling and caching it on first use; empty when prefix caching doesn't apply to this prompt.
+        """
+        if PREFIX_CACHE_TOKENS <= 0 or len(input_ids) <= PREFIX_CACHE_TOKENS or self.draft_model is not None:
+            return {}
+        if self._compiled:
+            # Bucket-padded prompts no longer start with the cached prefix
+            return {}
+        prefix = tuple(input_ids[:PREFIX_CACHE_TOKENS])
+        with self._response_cache_lock:
+            cache = self._prefix_cache.get(prefix)
+            if cache is not None:
+                self._prefix_cache.move_to_end(prefix)
+        if cache is None:
+            # no_grad rather than inference_mode: the copies are extended by generate() on other threads
+            with torch.no_grad():
+                cache = self.model(
+                    input_ids=torch.tensor([prefix], device=self.device),
+                    past_key_values=DynamicCache(),
+                    use_cache=True,
+                ).past_key_values
+            with self._response_cache_lock:
+                self._prefix_cache[prefix] = cache
+                while len(self._prefix_cache) > PREFIX_CACHE_SIZE:
+                    self._prefix_cache.popitem(last=False)
+        # generate() extends the cache in place, so each call gets its own copy
+        return {"past_key_values": copy.deepcopy(cache)}
+
+    @staticmethod
+    def _response_cache_key(message: str, params: dict):
+        """
+        Key for the response cache, or None when sampling makes the output non-deterministic.
+        """
+        if params.get("do_sample") and params.get("temperature", 0) > 0:
+            return None
+        raw = orjson.dumps({"p": message, "g": params}, option=orjson.OPT_SORT_KEYS)
+        return hashlib.blake2b(raw, digest_size=16).digest()
+
+    def get_cached_response(self, message: str, params: dict):
+        """
+        Return the cached response for a message and its full generation parameters, or None.
+        """
+        key = self._response_cache_key(message, params)
+        if key is None:
+            return None
+        with self._response_cache_lock:
+            response = self._response_cache.get(key)
+            if response is not None:
+                self._response_cache.move_to_end(key)
+            return response
+
+    def cache_response(self, message: str, params: dict, response: str):
+        """
+        Store a deterministic response, evicting the least recently used entry when full.
+        """
+        key = self._response_cache_key(message, params)
+        if key is None:
+            return
+        with self._response_cache_lock:
+            self._response_cache[key] = response
+            self._response_cache.move_to_end(key)
+            if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+
+    def clear_response_cache(self):
+        """
+        Drop all cached responses and prefix KV caches (they belong to the previously loaded model).
+        """
+        with self._response_cache_lock:
+            self._response_cache.clear()
+            self._prefix_cache.clear()
+
     def get_parameters(self) -> dict:
         """
         Get the current generation parameters used by the model.
@@ -205,7 +683,9 @@ class HFModelService:
         for k, v in updates.items():
             if k in self.parameters:
                 self.parameters[k] = v
+        self._default_generation_params = None
         self.last_parameters_update = datetime.utcnow().isoformat() + "Z"
+        self.state_version += 1
         return self.get_parameters()
 
     def reset_parameters(self) -> dict:
@@ -218,11 +698,21 @@ class HFModelService:
             "max_new_tokens": 300,
             "repetition_penalty": 1.0,
             "do_sample": False,
-            "num_beams": 6,
+            "num_beams": 1,
             "temperature": 0.3,
             "top_p": 0.95,
             "pad_token_id": self.tokenizer.pad_token_id if self.tokenizer else None,
             "num_return_sequences": 1
         }
+        self._default_generation_params = None
         self.last_parameters_update = datetime.utcnow().isoformat() + "Z"
-        return self.get_parameters() 
\ No newline at end of file
+        self.state_version += 1
+        return self.get_parameters()
+
+@lru_cache(maxsize=1)
+def get_hf_service() -> HFModelService:
+    """
+    Return the process-wide HFModelService instance.
+    All modules should obtain the service here so model weights are only ever loaded once.
+    """
+    return HFModelService()
@@ -0,0 +1,50 @@
+import queue
+import asyncio
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+class BufferedFileHandler(logging.FileHandler):
+    """File handler writing through a large buffer; flushing is left to a periodic task instead of every record"""
+    
+    def __init__(self, filename, buffer_size=64 * 1024, encoding="utf-8"):
+        self.buffer_size = buffer_size
+        super().__init__(filename, encoding=encoding)
+    
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=self.buffer_size, encoding=self.encoding, errors=self.errors)
+    
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+def setup_queue_logging(level, fmt, log_file, filters=()):
+    """
+    Route all logging through a QueueHandler so request threads only enqueue records.
+    A QueueListener thread formats and writes them to a buffered log file and stderr.
+    Filters run on the queue handler, i.e. in the logging caller's context (so they can read context variables).
+    Returns the started listener and the file handler (to be flushed periodically).
+    """
+    formatter = logging.Formatter(fmt)
+    file_handler = BufferedFileHandler(log_file)
+    file_handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+    
+    log_queue = queue.Queue(-1)
+    queue_handler = QueueHandler(log_queue)
+    # Only merge args into the message here; the listener's handlers apply the real format
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+    for log_filter in filters:
+        queue_handler.addFilter(log_filter)
+    logging.basicConfig(level=level, handlers=[queue_handler])
+    listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener, file_handler
+
+async def flush_periodically(handler, interval_seconds=1.0):
+    """Flush a buffered handler at a fixed interval (run as a background task)"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        handler.flush()
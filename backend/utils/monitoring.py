@@ -6,68 +6,128 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Memory and disk usage barely move between polls; reuse readings for this long
+USAGE_CACHE_TTL_SECONDS = 5.0
+# Bursts of health probes within this window share one system health reading
+HEALTH_CACHE_TTL_SECONDS = 1.0
+# CPU utilisation is measured over this window by a background sampler, off the request path
+CPU_SAMPLE_INTERVAL_SECONDS = 5.0
+
 class APIMonitor:
     """Monitor API performance and system health"""
     
     def __init__(self):
-        self.request_count = 0
-        self.error_count = 0
-        self.total_response_time = 0
         self.start_time = time.time()
         self.lock = threading.Lock()
+        # Per-thread [request_count, error_count, total_response_time] counters, only summed in get_stats
+        self._local = threading.local()
+        self._buckets = []
+        self._usage_cache = None  # (monotonic timestamp, usage dict)
+        self._health_cache = None  # (monotonic timestamp, health dict)
+        self._cpu_percent = None  # Latest background CPU sample
+        self._cpu_sampler = None
         
     def record_request(self, response_time: float, success: bool = True):
-        """Record a request with its response time"""
-        with self.lock:
-            self.request_count += 1
-            self.total_response_time += response_time
-            if not success:
-                self.error_count += 1
+        """Record a request with its response time (lock-free: each thread updates its own counters)"""
+        bucket = getattr(self._local, "bucket", None)
+        if bucket is None:
+            bucket = self._local.bucket = [0, 0, 0.0]
+            with self.lock:
+                self._buckets.append(bucket)
+        bucket[0] += 1
+        bucket[2] += response_time
+        if not success:
+            bucket[1] += 1
     
     def get_stats(self) -> Dict[str, Any]:
         """Get current API statistics"""
         with self.lock:
-            uptime = time.time() - self.start_time
-            avg_response_time = (
-                self.total_response_time / self.request_count 
-                if self.request_count > 0 else 0
-            )
-            error_rate = (
-                self.error_count / self.request_count * 100 
-                if self.request_count > 0 else 0
-            )
-            
-            return {
-                "uptime_seconds": uptime,
-                "total_requests": self.request_count,
-                "error_count": self.error_count,
-                "error_rate_percent": error_rate,
-                "avg_response_time_seconds": avg_response_time,
-                "requests_per_second": self.request_count / uptime if uptime > 0 else 0
+            buckets = list(self._buckets)
+        request_count = sum(b[0] for b in buckets)
+        error_count = sum(b[1] for b in buckets)
+        total_response_time = sum(b[2] for b in buckets)
+        
+        uptime = time.time() - self.start_time
+        avg_response_time = (
+            total_response_time / request_count 
+            if request_count > 0 else 0
+        )
+        error_rate = (
+            error_count / request_count * 100 
+            if request_count > 0 else 0
+        )
+        
+        return {
+            "uptime_seconds": uptime,
+            "total_requests": request_count,
+            "error_count": error_count,
+            "error_rate_percent": error_rate,
+            "avg_response_time_seconds": avg_response_time,
+            "requests_per_second": request_count / uptime if uptime > 0 else 0
+        }
+    
+    def _get_usage_snapshot(self) -> Dict[str, Any]:
+        """Get memory and disk usage, cached for a few seconds to avoid repeated syscalls"""
+        now = time.monotonic()
+        if self._usage_cache and now - self._usage_cache[0] < USAGE_CACHE_TTL_SECONDS:
+            return self._usage_cache[1]
+        
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        usage = {
+            "memory": {
+                "total_gb": memory.total / (1024**3),
+                "used_gb": memory.used / (1024**3),
+                "available_gb": memory.available / (1024**3),
+                "percent_used": memory.percent
+            },
+            "disk": {
+                "total_gb": disk.total / (1024**3),
+                "used_gb": disk.used / (1024**3),
+                "free_gb": disk.free / (1024**3),
+                "percent_used": (disk.used / disk.total) * 100
             }
+        }
+        self._usage_cache = (now, usage)
+        return usage
+    
+    def _sample_cpu(self):
+        """Keep self._cpu_percent up to date (runs in a daemon thread)"""
+        while True:
+            try:
+                self._cpu_percent = psutil.cpu_percent(interval=CPU_SAMPLE_INTERVAL_SECONDS)
+            except Exception as e:
+                logger.error(f"Error sampling CPU usage: {e}")
+                time.sleep(CPU_SAMPLE_INTERVAL_SECONDS)
+    
+    def _get_cpu_percent(self) -> float:
+        """Latest CPU utilisation, starting the background sampler on first use"""
+        if self._cpu_sampler is None:
+            with self.lock:
+                if self._cpu_sampler is None:
+                    self._cpu_sampler = threading.Thread(target=self._sample_cpu, name="cpu-sampler", daemon=True)
+                    self._cpu_sampler.start()
+        if self._cpu_percent is None:
+            # No full sample yet: non-blocking reading since the previous call
+            return psutil.cpu_percent(interval=None)
+        return self._cpu_percent
     
     def get_system_health(self) -> Dict[str, Any]:
-        """Get system health metrics"""
+        """Get system health metrics (memoized briefly so concurrent probes don't each sample the system)"""
+        cached = self._health_cache
+        if cached and time.monotonic() - cached[0] < HEALTH_CACHE_TTL_SECONDS:
+            return cached[1]
         try:
-            memory = psutil.virtual_memory()
-            disk = psutil.disk_usage('/')
-            cpu_percent = psutil.cpu_percent(interval=1)
+            usage = self._get_usage_snapshot()
+            cpu_percent = self._get_cpu_percent()
             
-            return {
-                "memory": {
-                    "total_gb": memory.total / (1024**3),
-                    "used_gb": memory.used / (1024**3),
-                    "available_gb": memory.available / (1024**3),
-                    "percent_used": memory.percent
-                },
-                "disk": {
-                    "total_gb": disk.total / (1024**3),
-                    "used_gb": disk.used / (1024**3),
-                    "free_gb": disk.free / (1024**3),
-                    "percent_used": (disk.used / disk.total) * 100
-                },
+            health = {
+                "memory": usage["memory"],
+                "disk": usage["disk"],
                 "cpu_percent": cpu_percent
             }
+            self._health_cache = (time.monotonic(), health)
+            return health
         except Exception as e:
             logger.error(f"Error getting system health: {e}")
             return {"error": str(e)}
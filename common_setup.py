@@ -0,0 +1,27 @@
+"""
+Environment defaults shared by the Aid-al-Neo server runner scripts
+"""
+
+import os
+
+# Development defaults; runners pass their own overrides (e.g. production keys and origins)
+DEFAULT_ENV = {
+    "ENV": "development",
+    "API_KEY": "test_api_key_123",
+    "ADMIN_TOKEN": "test_admin_token_456",
+    "MODEL_CACHE_DIR": "./models/cache",
+    "LOG_DIR": "./logs",
+    "PARAMS_DIR": "./params",
+    "ALLOWED_ORIGINS": "*",
+    # "HF_TOKEN": "your_hf_token_here",  # Optional: set if you have one
+}
+
+def apply_default_env(overrides=None):
+    """Create the data directories and set the environment defaults (values already in the environment win)"""
+    defaults = DEFAULT_ENV if overrides is None else DEFAULT_ENV | overrides
+
+    os.makedirs(defaults["MODEL_CACHE_DIR"], exist_ok=True)
+    os.makedirs(defaults["LOG_DIR"], exist_ok=True)
+    os.makedirs(defaults["PARAMS_DIR"], exist_ok=True)
+
+    os.environ.update({k: v for k, v in defaults.items() if k not in os.environ})
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Merge the fine-tuned LoRA adapters into the base model once and save the result as safetensors.
+Loaders then read the merged checkpoint directly (memory-mapped) instead of merging on every start.
+
+Usage: python export_merged_model.py [output_dir]
+"""
+
+import os
+import sys
+import time
+
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM
+from peft import PeftModel
+
+BASE_MODEL_ID = "mistralai/Mistral-7B-Instruct-v0.3"
+FINETUNED_MODEL_ID = "Pyzeur/Code-du-Travail-mistral-finetune"
+
+def export_merged_model(output_dir):
+    """Load base model + adapters, merge them and save the merged checkpoint and tokenizer"""
+    token = os.getenv("HF_TOKEN")
+    start_time = time.time()
+
+    print(f"🔄 Loading base model: {BASE_MODEL_ID}")
+    base_model = AutoModelForCausalLM.from_pretrained(
+        BASE_MODEL_ID,
+        torch_dtype=torch.float16,
+        low_cpu_mem_usage=True,
+        use_safetensors=True,
+        token=token,
+    )
+
+    print(f"🔄 Merging adapters: {FINETUNED_MODEL_ID}")
+    model = PeftModel.from_pretrained(base_model, FINETUNED_MODEL_ID, token=token).merge_and_unload()
+    tokenizer = AutoTokenizer.from_pretrained(FINETUNED_MODEL_ID, use_fast=True, token=token)
+
+    print(f"💾 Saving merged model to {output_dir}")
+    model.save_pretrained(output_dir, safe_serialization=True)
+    tokenizer.save_pretrained(output_dir)
+
+    print(f"✅ Merged model exported in {time.time() - start_time:.2f} seconds")
+
+if __name__ == "__main__":
+    export_merged_model(sys.argv[1] if len(sys.argv) > 1 else os.getenv("MERGED_MODEL_DIR", "./merged_model"))
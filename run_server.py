@@ -6,9 +6,12 @@ This version handles imports more carefully and provides better error handling
 
 import os
 import sys
+import importlib.util
 import logging
 from pathlib import Path
 
+from common_setup import apply_default_env
+
 # Set up logging first
 logging.basicConfig(
     level=logging.INFO,
@@ -16,71 +19,64 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Resolved once at import
+CURRENT_DIR = Path(__file__).parent.absolute()
+BACKEND_DIR = str(CURRENT_DIR / "backend")
+
 def setup_environment():
     """Set up environment variables and paths"""
     try:
-        # Get the current directory
-        current_dir = Path(__file__).parent.absolute()
-        backend_dir = current_dir / "backend"
-        
         # Add backend to Python path
-        if str(backend_dir) not in sys.path:
-            sys.path.insert(0, str(backend_dir))
-            logger.info(f"Added {backend_dir} to Python path")
+        if BACKEND_DIR not in sys.path:
+            sys.path.insert(0, BACKEND_DIR)
+            logger.info("Added %s to Python path", BACKEND_DIR)
         
-        # Create necessary directories
-        os.makedirs("./models/cache", exist_ok=True)
-        os.makedirs("./logs", exist_ok=True)
-        os.makedirs("./params", exist_ok=True)
-        
-        # Set environment variables
-        os.environ.setdefault("ENV", "development")
-        os.environ.setdefault("API_KEY", "test_api_key_123")
-        os.environ.setdefault("ADMIN_TOKEN", "test_admin_token_456")
-        os.environ.setdefault("MODEL_CACHE_DIR", "./models/cache")
-        os.environ.setdefault("LOG_DIR", "./logs")
-        os.environ.setdefault("PARAMS_DIR", "./params")
-        os.environ.setdefault("ALLOWED_ORIGINS", "*")
+        # Create the data directories and set the shared environment defaults
+        apply_default_env()
         
         logger.info("Environment setup completed")
-        logger.info(f"Current directory: {current_dir}")
-        logger.info(f"Backend directory: {backend_dir}")
-        logger.info(f"Python path: {sys.path[:3]}...")  # Show first 3 entries
+        logger.info("Current directory: %s", CURRENT_DIR)
+        logger.info("Backend directory: %s", BACKEND_DIR)
+        logger.info("Python path: %s...", sys.path[:3])  # Show first 3 entries
         
     except Exception as e:
-        logger.error(f"Failed to setup environment: {e}")
+        logger.error("Failed to setup environment: %s", e)
         sys.exit(1)
 
 def test_imports():
-    """Test if all required modules can be imported"""
+    """Check that all required modules can be found (without executing them: the server imports them anyway)"""
+    if os.environ.get("SKIP_IMPORT_TEST") == "1":
+        return True
     try:
         logger.info("Testing imports...")
         
-        # Test basic imports
-        import fastapi
-        import uvicorn
-        logger.info("✓ FastAPI and uvicorn imported successfully")
-        
-        # Test backend imports
-        from backend import main
-        logger.info("✓ Backend main module imported successfully")
-        
-        from backend.api import routes
-        logger.info("✓ Backend routes imported successfully")
-        
-        from backend.services import hf_model_service
-        logger.info("✓ HF model service imported successfully")
-        
-        logger.info("All imports successful!")
+        required_modules = [
+            "fastapi",
+            "uvicorn",
+            "backend.main",
+            "backend.api.routes",
+            "backend.services.hf_model_service",
+        ]
+        missing_modules = [
+            name for name in required_modules
+            if name not in sys.modules and importlib.util.find_spec(name) is None
+        ]
+        if missing_modules:
+            logger.error("Modules not found: %s", missing_modules)
+            logger.error("Please check that all dependencies are installed:")
+            logger.error("pip install -r requirements.txt")
+            return False
+        
+        logger.info("All imports found!")
         return True
         
     except ImportError as e:
-        logger.error(f"Import error: {e}")
+        logger.error("Import error: %s", e)
         logger.error("Please check that all dependencies are installed:")
         logger.error("pip install -r requirements.txt")
         return False
     except Exception as e:
-        logger.error(f"Unexpected error during import test: {e}")
+        logger.error("Unexpected error during import test: %s", e)
         return False
 
 def run_server():
@@ -88,10 +84,12 @@ def run_server():
     try:
         logger.info("Starting Aid-al-Neo API server...")
         
-        # Import the app
-        from backend.main import app
+        # Each worker process imports the app itself (import string); test_imports() already located it
+        workers = int(os.getenv("WORKERS", "1"))
+        # Per-request access logs cost throughput; keep them for development only
+        production = os.getenv("ENV") == "production"
         
-        logger.info("✓ FastAPI app imported successfully")
+        logger.info("Workers: %s", workers)
         logger.info("Server will be available at: http://localhost:8000")
         logger.info("API documentation at: http://localhost:8000/docs")
         logger.info("Health check at: http://localhost:8000/api/v1/health")
@@ -100,23 +98,29 @@ def run_server():
         import uvicorn
         
         # Run the server
+        # WORKERS > 1 runs separate processes, each loading its own copy of the model
         uvicorn.run(
-            app,
+            "backend.main:app",
             host="0.0.0.0",
             port=8000,
             reload=False,  # Disable reload for stability
-            log_level="info",
-            access_log=True
+            loop="uvloop",  # libuv event loop instead of the pure-Python asyncio selector loop
+            http="httptools",  # C HTTP/1.1 parser
+            timeout_keep_alive=75,  # Keep idle client connections open between chat requests
+            backlog=2048,  # Absorb connection bursts instead of dropping SYNs
+            limit_concurrency=int(os.getenv("MAX_CONCURRENCY", "100")),  # 503 beyond this many open connections/tasks
+            workers=workers,
+            log_level="warning" if production else "info",
+            access_log=not production
         )
         
     except ImportError as e:
-        logger.error(f"Missing dependency: {e}")
+        logger.error("Missing dependency: %s", e)
         logger.error("Please install requirements: pip install -r requirements.txt")
         sys.exit(1)
     except Exception as e:
-        logger.error(f"Failed to start server: {e}")
-        import traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        # The handler formats the traceback only if the record is emitted
+        logger.exception("Failed to start server: %s", e)
         sys.exit(1)
 
 def main():
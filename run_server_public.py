@@ -10,9 +10,12 @@ import sys
 import logging
 from pathlib import Path
 
+from common_setup import apply_default_env
+
 # Add the backend directory to Python path
-backend_path = Path(__file__).parent / "backend"
-sys.path.insert(0, str(backend_path))
+backend_path = str(Path(__file__).parent / "backend")
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
 
 # Set up logging
 logging.basicConfig(
@@ -21,21 +24,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Production overrides of the shared environment defaults
+PRODUCTION_ENV = {
+    "ENV": "production",
+    "API_KEY": "your_secure_api_key_here",  # CHANGE THIS!
+    "ADMIN_TOKEN": "your_secure_admin_token_here",  # CHANGE THIS!
+    "ALLOWED_ORIGINS": "https://cryptomaltese.com,https://www.cryptomaltese.com",
+}
+
 def setup_environment():
     """Set up environment variables for public access"""
-    # Create necessary directories
-    os.makedirs("./models/cache", exist_ok=True)
-    os.makedirs("./logs", exist_ok=True)
-    os.makedirs("./params", exist_ok=True)
-    
-    # Set environment variables for public access
-    os.environ.setdefault("ENV", "production")
-    os.environ.setdefault("API_KEY", "your_secure_api_key_here")  # CHANGE THIS!
-    os.environ.setdefault("ADMIN_TOKEN", "your_secure_admin_token_here")  # CHANGE THIS!
-    os.environ.setdefault("MODEL_CACHE_DIR", "./models/cache")
-    os.environ.setdefault("LOG_DIR", "./logs")
-    os.environ.setdefault("PARAMS_DIR", "./params")
-    os.environ.setdefault("ALLOWED_ORIGINS", "https://cryptomaltese.com,https://www.cryptomaltese.com")
+    # Create the data directories and set the shared environment defaults with the production overrides
+    apply_default_env(PRODUCTION_ENV)
     
     logger.info("Environment setup completed for public access")
 
@@ -43,29 +43,42 @@ def run_server():
     """Run the FastAPI server on all interfaces"""
     try:
         import uvicorn
-        from backend.main_improved import app  # Use improved version for security
+        
+        # Each worker process imports the app itself (import string)
+        workers = int(os.getenv("WORKERS", "1"))
+        # Per-request access logs cost throughput; keep them for development only
+        production = os.getenv("ENV") == "production"
         
         logger.info("Starting Aid-al-Neo API server for public access...")
+        logger.info("Workers: %s", workers)
         logger.info("⚠️  WARNING: Server will be accessible from the internet!")
         logger.info("Server will be available at: http://0.0.0.0:8000")
         logger.info("API documentation at: http://0.0.0.0:8000/docs")
         logger.info("Health check at: http://0.0.0.0:8000/health")
         
         # Run the server on all interfaces
+        # WORKERS > 1 runs separate processes, each loading its own copy of the model
         uvicorn.run(
-            app,
+            "backend.main_improved:app",  # Use improved version for security
             host="0.0.0.0",  # Bind to all interfaces
             port=8000,
             reload=False,  # Disable reload for production
-            log_level="info"
+            loop="uvloop",  # libuv event loop instead of the pure-Python asyncio selector loop
+            http="httptools",  # C HTTP/1.1 parser
+            timeout_keep_alive=75,  # Keep idle client connections open between chat requests
+            backlog=2048,  # Absorb connection bursts instead of dropping SYNs
+            limit_concurrency=int(os.getenv("MAX_CONCURRENCY", "100")),  # 503 beyond this many open connections/tasks
+            workers=workers,
+            log_level="warning" if production else "info",
+            access_log=not production
         )
         
     except ImportError as e:
-        logger.error(f"Missing dependency: {e}")
+        logger.error("Missing dependency: %s", e)
         logger.error("Please install requirements: pip install -r requirements.txt")
         sys.exit(1)
     except Exception as e:
-        logger.error(f"Failed to start server: {e}")
+        logger.exception("Failed to start server: %s", e)
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -7,6 +7,9 @@ Run this to install dependencies and prepare the environment
 import os
 import sys
 import subprocess
+import compileall
+import importlib.util
+import re
 import logging
 from pathlib import Path
 
@@ -16,21 +19,37 @@ logger = logging.getLogger(__name__)
 
 def check_python_version():
     """Check if Python version is compatible"""
-    if sys.version_info < (3, 8):
-        logger.error("Python 3.8 or higher is required")
+    if sys.version_info < (3, 11):
+        logger.error("Python 3.11 or higher is required")
         sys.exit(1)
-    logger.info(f"Python version: {sys.version}")
+    logger.info("Python version: %s", sys.version)
+
+# Local wheelhouse filled by `python setup_server.py --download-wheels`; installs then skip PyPI entirely
+WHEELS_DIR = "./wheels"
+PIP = [sys.executable, "-m", "pip", "--disable-pip-version-check"]
 
 def install_requirements():
-    """Install required packages"""
+    """Install required packages (offline from the local wheelhouse when it exists)"""
     logger.info("Installing requirements...")
+    command = PIP + ["install", "-r", "requirements.txt"]
+    if os.path.isdir(WHEELS_DIR):
+        logger.info("Installing from local wheels in %s", WHEELS_DIR)
+        command += ["--no-index", "--find-links", WHEELS_DIR]
     try:
-        subprocess.check_call([
-            sys.executable, "-m", "pip", "install", "-r", "requirements.txt"
-        ])
+        subprocess.check_call(command)
         logger.info("Requirements installed successfully")
     except subprocess.CalledProcessError as e:
-        logger.error(f"Failed to install requirements: {e}")
+        logger.error("Failed to install requirements: %s", e)
+        sys.exit(1)
+
+def cache_wheels():
+    """Download wheels for all requirements (and their dependencies) into the local wheelhouse"""
+    logger.info("Downloading wheels to %s...", WHEELS_DIR)
+    try:
+        subprocess.check_call(PIP + ["download", "-r", "requirements.txt", "-d", WHEELS_DIR])
+        logger.info("Wheels downloaded successfully")
+    except subprocess.CalledProcessError as e:
+        logger.error("Failed to download wheels: %s", e)
         sys.exit(1)
 
 def create_directories():
@@ -43,34 +62,47 @@ def create_directories():
     
     for directory in directories:
         os.makedirs(directory, exist_ok=True)
-        logger.info(f"Created directory: {directory}")
+        logger.info("Created directory: %s", directory)
 
 def check_dependencies():
     """Check if all required packages are installed"""
     required_packages = [
         "fastapi",
         "uvicorn", 
+        "uvloop",
+        "httptools",
+        "orjson",
         "transformers",
         "torch",
         "huggingface_hub",
         "requests"
     ]
     
-    missing_packages = []
-    for package in required_packages:
-        try:
-            __import__(package.replace("-", "_"))
-        except ImportError:
-            missing_packages.append(package)
+    # find_spec only locates each package; importing them (torch, transformers) would take seconds
+    missing_packages = [
+        package for package in required_packages
+        if importlib.util.find_spec(package.replace("-", "_")) is None
+    ]
     
     if missing_packages:
-        logger.error(f"Missing packages: {missing_packages}")
+        logger.error("Missing packages: %s", missing_packages)
         logger.error("Please run: pip install -r requirements.txt")
         return False
     
     logger.info("All required packages are installed")
     return True
 
+def precompile_backend():
+    """Compile the backend to .pyc up front (in parallel) so the first server start doesn't have to"""
+    # Installed packages were already byte-compiled by pip; the default optimization level is the one
+    # a plain `python` interpreter loads (-O/-OO .pyc files would be ignored)
+    backend_dir = Path(__file__).parent / "backend"
+    # Skip macOS AppleDouble "._*" metadata files, which are not Python sources
+    if compileall.compile_dir(str(backend_dir), rx=re.compile(r"/\._"), quiet=1, workers=0):
+        logger.info("Backend bytecode compiled")
+    else:
+        logger.warning("Some backend modules failed to compile")
+
 def main():
     """Main setup function"""
     logger.info("Setting up Aid-al-Neo server environment...")
@@ -86,6 +118,9 @@ def main():
         install_requirements()
         check_dependencies()
     
+    # Byte-compile the backend
+    precompile_backend()
+    
     logger.info("Setup completed successfully!")
     logger.info("\nNext steps:")
     logger.info("1. Run the server: python test_server.py")
@@ -94,4 +129,7 @@ def main():
     logger.info("4. View documentation at: http://localhost:8000/docs")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    if "--download-wheels" in sys.argv:
+        cache_wheels()
+    else:
+        main() 
\ No newline at end of file
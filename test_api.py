@@ -4,9 +4,9 @@ Test script for Aid-al-Neo API
 Run this after starting the server to test the endpoints
 """
 
-import requests
+import asyncio
+import httpx
 import json
-import time
 import sys
 
 # Configuration
@@ -14,115 +14,182 @@ BASE_URL = "http://localhost:8000"
 API_KEY = "test_api_key_123"
 ADMIN_TOKEN = "test_admin_token_456"
 
-def test_health():
+# How long to wait for the server to answer /health before running the tests
+STARTUP_TIMEOUT = 30
+STARTUP_POLL_INTERVAL = 0.2
+
+# /health answers while the model is still loading; then wait this long for /models to report it loaded
+MODEL_LOAD_TIMEOUT = 900
+MODEL_LOAD_POLL_INTERVAL = 2
+
+# The tests run concurrently; each one prints its whole report once its response is in,
+# so the output of different tests doesn't interleave.
+
+async def test_health(client):
     """Test the health endpoint"""
-    print("Testing health endpoint...")
     try:
-        response = requests.get(f"{BASE_URL}/api/v1/health")
+        response = await client.get("/api/v1/health")
+        print("Testing health endpoint...")
         print(f"Status: {response.status_code}")
         print(f"Response: {response.json()}")
         return response.status_code == 200
     except Exception as e:
-        print(f"Error: {e}")
+        print(f"Health endpoint error: {e}")
         return False
 
-def test_chat():
+async def test_chat(client):
     """Test the chat endpoint"""
-    print("\nTesting chat endpoint...")
     try:
-        headers = {
-            "Authorization": f"Bearer {API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
         data = {
             "message": "Bonjour, pouvez-vous m'expliquer les règles de licenciement en France?",
             "channel": "test",
             "user_id": "test_user_123"
         }
-        
-        print(f"Sending request to {BASE_URL}/api/v1/chat")
-        print(f"Data: {json.dumps(data, indent=2)}")
-        
-        response = requests.post(
-            f"{BASE_URL}/api/v1/chat",
-            headers=headers,
+
+        response = await client.post(
+            "/api/v1/chat",
             json=data,
             timeout=120  # 2 minutes timeout for model generation
         )
-        
+
+        print("\nTesting chat endpoint...")
+        print(f"Sent request to {BASE_URL}/api/v1/chat")
+        print(f"Data: {json.dumps(data, indent=2)}")
         print(f"Status: {response.status_code}")
         if response.status_code == 200:
             result = response.json()
             print(f"Response: {json.dumps(result, indent=2, ensure_ascii=False)}")
         else:
             print(f"Error response: {response.text}")
-        
+
         return response.status_code == 200
     except Exception as e:
-        print(f"Error: {e}")
+        print(f"Chat endpoint error: {e}")
+        return False
+
+async def test_chat_parameter_bounds(client):
+    """Test that out-of-range generation parameters are rejected with 422"""
+    out_of_range = [
+        {"max_new_tokens": 100000},
+        {"num_beams": 64},
+        {"top_p": 50},
+        {"temperature": -1},
+        {"repetition_penalty": 0},
+    ]
+    try:
+        responses = await asyncio.gather(*(
+            client.post(
+                "/api/v1/chat",
+                json={"message": "Bonjour", "channel": "test", "user_id": "test_user_123", "parameters": parameters},
+            )
+            for parameters in out_of_range
+        ))
+
+        print("\nTesting chat parameter bounds...")
+        for parameters, response in zip(out_of_range, responses):
+            print(f"{parameters}: {response.status_code}")
+
+        return all(response.status_code == 422 for response in responses)
+    except Exception as e:
+        print(f"Chat parameter bounds error: {e}")
         return False
 
-def test_models():
+async def test_models(client):
     """Test the models endpoint"""
-    print("\nTesting models endpoint...")
     try:
-        headers = {
-            "Authorization": f"Bearer {API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.get(
-            f"{BASE_URL}/api/v1/models",
-            headers=headers
-        )
-        
+        response = await client.get("/api/v1/models")
+
+        print("\nTesting models endpoint...")
         print(f"Status: {response.status_code}")
         if response.status_code == 200:
             result = response.json()
             print(f"Response: {json.dumps(result, indent=2)}")
         else:
             print(f"Error response: {response.text}")
-        
+
         return response.status_code == 200
     except Exception as e:
-        print(f"Error: {e}")
+        print(f"Models endpoint error: {e}")
         return False
 
-def main():
-    """Run all tests"""
-    print("Aid-al-Neo API Test Suite")
-    print("=" * 50)
-    
-    # Wait a bit for server to start
-    print("Waiting for server to be ready...")
-    time.sleep(5)
-    
+async def wait_for_server(client):
+    """Poll /health until the server answers (or STARTUP_TIMEOUT elapses)"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STARTUP_TIMEOUT
+    while loop.time() < deadline:
+        try:
+            if (await client.get("/api/v1/health", timeout=2)).status_code == 200:
+                return True
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(STARTUP_POLL_INTERVAL)
+    return False
+
+async def wait_for_model(client):
+    """Poll /models until the model reports "loaded" (or MODEL_LOAD_TIMEOUT elapses)"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + MODEL_LOAD_TIMEOUT
+    while loop.time() < deadline:
+        try:
+            response = await client.get("/api/v1/models", timeout=5)
+            if response.status_code == 200 and any(
+                model.get("status") == "loaded" for model in response.json().get("models", [])
+            ):
+                return True
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(MODEL_LOAD_POLL_INTERVAL)
+    return False
+
+async def run_tests():
+    """Wait for the server, then run all tests concurrently"""
     tests = [
         ("Health Check", test_health),
         ("Models List", test_models),
         ("Chat Endpoint", test_chat),
+        ("Chat Parameter Bounds", test_chat_parameter_bounds),
     ]
-    
-    results = []
-    for test_name, test_func in tests:
-        print(f"\n{'='*20} {test_name} {'='*20}")
-        success = test_func()
-        results.append((test_name, success))
-        time.sleep(2)  # Brief pause between tests
-    
+
+    # One pooled keep-alive connection set for all requests, with the API key sent by default
+    async with httpx.AsyncClient(
+        base_url=BASE_URL,
+        headers={"Authorization": f"Bearer {API_KEY}"},
+        timeout=30,
+    ) as client:
+        print("Waiting for server to be ready...")
+        if not await wait_for_server(client):
+            # Don't pile the test timeouts (up to 2 minutes for chat) on top of an unreachable server
+            print(f"Server did not become ready within {STARTUP_TIMEOUT} seconds")
+            return [(test_name, False) for test_name, _ in tests]
+
+        print("Waiting for the model to load...")
+        if not await wait_for_model(client):
+            print(f"Model did not finish loading within {MODEL_LOAD_TIMEOUT} seconds")
+            return [(test_name, False) for test_name, _ in tests]
+
+        outcomes = await asyncio.gather(*(test_func(client) for _, test_func in tests))
+
+    return [(test_name, success) for (test_name, _), success in zip(tests, outcomes)]
+
+def main():
+    """Run all tests"""
+    print("Aid-al-Neo API Test Suite")
+    print("=" * 50)
+
+    results = asyncio.run(run_tests())
+
     # Summary
     print(f"\n{'='*50}")
     print("TEST SUMMARY")
     print("=" * 50)
-    
+
     all_passed = True
     for test_name, success in results:
         status = "PASS" if success else "FAIL"
         print(f"{test_name}: {status}")
         if not success:
             all_passed = False
-    
+
     if all_passed:
         print("\n🎉 All tests passed!")
         print("\nYou can now:")
@@ -134,4 +201,4 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
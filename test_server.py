@@ -9,9 +9,12 @@ import sys
 import logging
 from pathlib import Path
 
+from common_setup import apply_default_env
+
 # Add the backend directory to Python path
-backend_path = Path(__file__).parent / "backend"
-sys.path.insert(0, str(backend_path))
+backend_path = str(Path(__file__).parent / "backend")
+if backend_path not in sys.path:
+    sys.path.insert(0, backend_path)
 
 # Set up logging
 logging.basicConfig(
@@ -22,22 +25,8 @@ logger = logging.getLogger(__name__)
 
 def setup_environment():
     """Set up environment variables for testing"""
-    # Create necessary directories
-    os.makedirs("./models/cache", exist_ok=True)
-    os.makedirs("./logs", exist_ok=True)
-    os.makedirs("./params", exist_ok=True)
-    
-    # Set environment variables
-    os.environ.setdefault("ENV", "development")
-    os.environ.setdefault("API_KEY", "test_api_key_123")
-    os.environ.setdefault("ADMIN_TOKEN", "test_admin_token_456")
-    os.environ.setdefault("MODEL_CACHE_DIR", "./models/cache")
-    os.environ.setdefault("LOG_DIR", "./logs")
-    os.environ.setdefault("PARAMS_DIR", "./params")
-    os.environ.setdefault("ALLOWED_ORIGINS", "*")
-    
-    # Optional: Set HF token if you have one
-    # os.environ.setdefault("HF_TOKEN", "your_hf_token_here")
+    # Create the data directories and set the shared environment defaults
+    apply_default_env()
     
     logger.info("Environment setup completed")
 
@@ -57,16 +46,21 @@ def run_server():
             "backend.main:app",  # Use import string for reload
             host="0.0.0.0",  # Allow external connections
             port=8000,
-            reload=True,  # Auto-reload on code changes
+            reload="--reload" in sys.argv,  # Auto-reload on code changes only when asked: python test_server.py --reload
+            loop="uvloop",  # libuv event loop instead of the pure-Python asyncio selector loop
+            http="httptools",  # C HTTP/1.1 parser
+            timeout_keep_alive=75,  # Keep idle client connections open between chat requests
+            backlog=2048,  # Absorb connection bursts instead of dropping SYNs
+            limit_concurrency=int(os.getenv("MAX_CONCURRENCY", "100")),  # 503 beyond this many open connections/tasks
             log_level="info"
         )
         
     except ImportError as e:
-        logger.error(f"Missing dependency: {e}")
+        logger.error("Missing dependency: %s", e)
         logger.error("Please install requirements: pip install -r requirements.txt")
         sys.exit(1)
     except Exception as e:
-        logger.error(f"Failed to start server: {e}")
+        logger.error("Failed to start server: %s", e)
         sys.exit(1)
 
 if __name__ == "__main__":